@@ -0,0 +1,68 @@
+"""Замер скорости генерации матчей для всех форматов турниров.
+
+    python src/benchmark_formats.py --teams 16 128 1024
+"""
+import argparse
+import random
+import time
+from datetime import datetime
+
+import consts
+import dto
+import formats
+
+
+def make_teams(count: int) -> list[dto.Team]:
+    now = datetime.now(None)
+    return [dto.Team(team_id=i, title=f'Команда {i}', created_at=now) for i in range(1, count + 1)]
+
+
+def play(matches: list[dto.Match], rng: random.Random):
+    for match in matches:
+        if match.winner_id is None:
+            match.winner_id = rng.choice(match.participants).team_id
+
+
+def bench_generation(tournament_format: consts.TournamentFormat, teams: list[dto.Team]) -> tuple[float, int]:
+    started = time.perf_counter()
+    matches = formats.get_format(tournament_format, 1, teams).get_matches()
+    return time.perf_counter() - started, len(matches)
+
+
+def bench_swiss(teams: list[dto.Team], rng: random.Random) -> tuple[float, int, int]:
+    """Проводит все туры швейцарской системы со случайными победителями."""
+    played: list[dto.Match] = []
+    elapsed = 0.0
+    while True:
+        started = time.perf_counter()
+        matches = formats.Swiss(1, teams, played=played).get_matches()
+        elapsed += time.perf_counter() - started
+        if not matches:
+            break
+        play(matches, rng)
+        played.extend(matches)
+
+    pairs = [
+        frozenset(team.team_id for team in match.participants)
+        for match in played if None not in match.participants
+    ]
+    return elapsed, len(played), len(pairs) - len(set(pairs))
+
+
+def main(sizes: list[int], seed: int):
+    rng = random.Random(seed)
+    for size in sizes:
+        teams = make_teams(size)
+        for tournament_format in (consts.TournamentFormat.SINGLE_ELIMINATION, consts.TournamentFormat.ROUND_ROBIN):
+            elapsed, count = bench_generation(tournament_format, teams)
+            print(f'{tournament_format.value:<20} teams={size:<6} matches={count:<8} {elapsed * 1000:10.1f} ms')
+        elapsed, count, rematches = bench_swiss(teams, rng)
+        print(f'{"SWISS":<20} teams={size:<6} matches={count:<8} {elapsed * 1000:10.1f} ms  rematches={rematches}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Замер скорости генерации матчей для форматов турниров')
+    parser.add_argument('--teams', type=int, nargs='+', default=[16, 128, 1024])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    main(args.teams, args.seed)
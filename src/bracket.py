@@ -1,112 +1,159 @@
-import math
+import hashlib
 import random
+from functools import lru_cache
+from typing import NamedTuple
+from uuid import UUID, NAMESPACE_URL, uuid5
+
+import asyncpg
 
 import dto
+import settings
+
+BRACKET_NAMESPACE = uuid5(NAMESPACE_URL, 'foosball-tournament/bracket')
+
+
+def draw_key(tour_id: int, teams: list[dto.Team]) -> str:
+    """Ключ жеребьевки: от него зависят UUID сгенерированных матчей турнира."""
+    return hashlib.sha256(f'{tour_id}:{",".join(str(team.team_id) for team in teams)}'.encode()).hexdigest()
+
+
+def matches_from_records(
+    tour_id: int,
+    records: list[asyncpg.Record],
+    teams: list[dto.Team]
+) -> list[dto.Match]:
+    teams_by_id = {
+        team.team_id: dto.TournamentTeam(**team.dict(), team_number=i + 1) for i, team in enumerate(teams)
+    }
+    matches = []
+    for record in records:
+        matches.append(
+            dto.Match(
+                match_uuid=UUID(record['match_uuid']),
+                tour_id=tour_id,
+                participants=[
+                    teams_by_id.get(record['first_team_id']),
+                    teams_by_id.get(record['second_team_id'])
+                ],
+                winner_id=record['winner_id'],
+                parent_uuid=UUID(record['parent_uuid']) if record['parent_uuid'] else None,
+                started_at=record['started_at'],
+                round=record['round'],
+            )
+        )
+    return matches
+
+
+def seeded_order(teams: list[dto.Team], seed: int) -> list[dto.TournamentTeam]:
+    """Жеребьевка: команды упорядочиваются по ID и перемешиваются генератором с заданным seed.
+
+    Одинаковые команды и seed всегда дают одинаковые номера, список вызывающей стороны не меняется.
+    """
+    ordered = sorted(teams, key=lambda team: team.team_id)
+    random.Random(seed).shuffle(ordered)
+    return [
+        dto.TournamentTeam(**team.dict(exclude={'team_number'}), team_number=i + 1) for i, team in enumerate(ordered)
+    ]
+
+
+class TemplateMatch(NamedTuple):
+    # Номер команды в жеребьевке, начиная с нуля, или None, если участник придет из предыдущего матча
+    first: int | None
+    second: int | None
+    parent: int | None
+    round: int
+
+
+def _divide_seeds(teams_count: int) -> list[int | None]:
+    rounds = (teams_count - 1).bit_length()
+    divided: list[int | None] = [1]
+    pending: list[int | None] = list(range(2, teams_count + 1)) + [None] * (2 ** rounds - teams_count)
+    count = 0
+
+    for _ in range(rounds):
+        number = max(seed for seed in divided if seed is not None)
+        target = number
+        for _ in range(len(divided)):
+            index = divided.index(target) + 1
+            divided.insert(index, pending[count])
+
+            number -= 1
+            # Если команды с таким номером еще нет в списке, следующая вставка идет после первого пустого места
+            target = number if number in divided else None
+            count += 1
+
+    return divided
+
+
+@lru_cache(maxsize=settings.BRACKET_TEMPLATE_CACHE_SIZE)
+def bracket_template(teams_count: int) -> tuple[TemplateMatch, ...]:
+    """Структура сетки плей-офф, которая зависит только от количества команд.
+
+    Матчи идут по раундам, участники первого раунда и команды, пропускающие его,
+    указаны номерами в жеребьевке, связи между матчами - индексами родительских матчей.
+    Команды, пропускающие первый раунд, сразу попадают в матчи второго.
+    """
+    if teams_count < 2:
+        raise ValueError('Невозможно создать сетку из одной команды')
+
+    divided = _divide_seeds(teams_count)
+    matches: list[list] = []
+
+    # Создание матчей для первого раунда. Команды, у которых нет соперников,
+    # не прикрепляются к матчам до тех пор, пока не будут сформированы матчи следующих раундов,
+    # где этим командам будет найден соперник
+    items: list[tuple[bool, int]] = []
+    for n in range(0, len(divided), 2):
+        # Если после команды в списке следует None, значит у команды нет соперника
+        if divided[n + 1] is None:
+            items.append((True, divided[n] - 1))
+        else:
+            matches.append([divided[n] - 1, divided[n + 1] - 1, None, 1])
+            items.append((False, len(matches) - 1))
+
+    round_number = 1
+    while len(items) > 1:
+        round_number += 1
+        next_items = []
+        for i in range(0, len(items), 2):
+            match = [None, None, None, round_number]
+            matches.append(match)
+            for side, (is_team, value) in enumerate(items[i:i + 2]):
+                if is_team:
+                    match[side] = value
+                else:
+                    matches[value][2] = len(matches) - 1
+            next_items.append((False, len(matches) - 1))
+        items = next_items
+
+    return tuple(TemplateMatch(*match) for match in matches)
 
 
 class TournamentBracket:
-    def __init__(self, tour_id: int, teams: list[dto.Team]):
+    """Сетка плей-офф: готовый шаблон для количества команд, заполненный командами по их номерам в жеребьевке."""
+
+    def __init__(self, tour_id: int, teams: list[dto.TournamentTeam]):
         self.tour_id = tour_id
-        random.shuffle(teams)
-        self.teams = self._number_the_teams_within_tournament(teams)
-        self.teams_length = len(teams)
-        self.matches = []
+        self.teams = sorted(teams, key=lambda team: team.team_number)
 
-    def get_matches(self) -> list[dto.Match]:
-        self._create_matches()
-        return self.matches
-
-    @staticmethod
-    def _number_the_teams_within_tournament(teams: list[dto.Team]) -> list[dto.TournamentTeam]:
-        return [dto.TournamentTeam(**teams[i].__dict__, team_number=i + 1) for i in range(len(teams))]
-
-    @staticmethod
-    def _get_team_with_max_team_number(teams: list[dto.TournamentTeam]):
-        max_num = 0
-        team_with_max_team_number = None
-        for team in teams:
-            if team is not None and team.team_number > max_num:
-                max_num = team.team_number
-                team_with_max_team_number = team
-        return team_with_max_team_number
-
-    @staticmethod
-    def _get_team_by_team_number(teams: list[dto.TournamentTeam], team_num: int):
-        for team in teams:
-            if team is not None and team.team_number == team_num:
-                return team
-
-    def _divide_teams(self) -> list[dto.TournamentTeam | None]:
-        divided_teams = [self.teams[0]]
-        temp: list[dto.Team | None] = self.teams[1:]
-        count = 0
-
-        for _ in range(0, int(2 ** math.ceil(math.log(self.teams_length, 2)) - self.teams_length)):
-            temp.append(None)
-
-        for _ in range(0, int(math.ceil(math.log(self.teams_length, 2)))):
-            team_with_max_tournament_number = self._get_team_with_max_team_number(divided_teams)
-            max_tournament_number = team_with_max_tournament_number.team_number
-            for _ in range(len(divided_teams)):
-                index = divided_teams.index(team_with_max_tournament_number) + 1
-                divided_teams.insert(index, temp[count])
-
-                max_tournament_number -= 1
-                team_with_max_tournament_number = self._get_team_by_team_number(divided_teams, max_tournament_number)
-                count += 1
-
-        return divided_teams
-
-    def _create_matches(self):
-        divided_teams = self._divide_teams()
-
-        # Создание матчей для первого раунда. Команды, у которых нет соперников,
-        # не прикрепляются к матчам до тех пор, пока не будут сформированы матчи следующих раундов,
-        # где этим командам будет найден соперник
-        first_round: list[dto.Match | dto.TournamentTeam] = []
-        for n in range(0, len(divided_teams), 2):
-
-            # Если после команды в списке следует None, значит у команды нет соперника
-            if divided_teams[n + 1] is None:
-                first_round.append(divided_teams[n])
-
-            else:
-                # Создание матча с двумя рядом стоящим в списке командами
-                match = dto.Match(
-                    tour_id=self.tour_id,
-                    participants=[
-                        divided_teams[n],
-                        divided_teams[n + 1]
-                    ]
-                )
-                first_round.append(match)
-                self.matches.append(match)
-
-        self._create_matches_after_first_round(first_round)
-
-    def _create_matches_after_first_round(self, items: list[dto.TournamentTeam | dto.Match]):
-        if len(items) == 1:
-            return
-
-        matches_on_current_round: list[dto.Match] = []
-        for i in range(0, len(items), 2):
+    def _match_uuids(self, count: int) -> list[UUID]:
+        # UUID матчей зависят только от турнира и жеребьевки, поэтому одинаковые входные данные дают одинаковую сетку
+        key = draw_key(self.tour_id, self.teams)
+        return [uuid5(BRACKET_NAMESPACE, f'{key}:{i}') for i in range(count)]
 
-            match = dto.Match(
+    def get_matches(self) -> list[dto.Match]:
+        template = bracket_template(len(self.teams))
+        uuids = self._match_uuids(len(template))
+        return [
+            dto.Match.construct(
+                match_uuid=uuids[i],
                 tour_id=self.tour_id,
-                participants=[None, None]
+                participants=[
+                    self.teams[match.first] if match.first is not None else None,
+                    self.teams[match.second] if match.second is not None else None,
+                ],
+                parent_uuid=uuids[match.parent] if match.parent is not None else None,
+                round=match.round,
             )
-
-            if isinstance(items[i], dto.TournamentTeam):
-                match.participants[0] = items[i]
-            else:
-                items[i].parent_uuid = match.match_uuid
-
-            if isinstance(items[i + 1], dto.TournamentTeam):
-                match.participants[1] = items[i + 1]
-            else:
-                items[i + 1].parent_uuid = match.match_uuid
-
-            matches_on_current_round.append(match)
-            self.matches.append(match)
-
-        self._create_matches_after_first_round(matches_on_current_round)
+            for i, match in enumerate(template)
+        ]
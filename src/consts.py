@@ -5,3 +5,26 @@ class TournamentStatus(Enum):
     OPENED = 'OPENED'
     ACTIVE = 'ACTIVE'
     FINISHED = 'FINISHED'
+
+
+class TournamentFormat(Enum):
+    SINGLE_ELIMINATION = 'SINGLE_ELIMINATION'
+    ROUND_ROBIN = 'ROUND_ROBIN'
+    SWISS = 'SWISS'
+
+
+class ExportFormat(Enum):
+    CSV = 'csv'
+    NDJSON = 'ndjson'
+
+
+class JobStatus(Enum):
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    DONE = 'DONE'
+    FAILED = 'FAILED'
+
+
+class JobKind(Enum):
+    MATERIALIZE_BRACKET = 'MATERIALIZE_BRACKET'
+    RATING_BACKFILL = 'RATING_BACKFILL'
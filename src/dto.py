@@ -1,3 +1,4 @@
+import random
 from datetime import datetime
 from uuid import UUID, uuid4
 
@@ -64,6 +65,8 @@ class Tournament(BaseModel):
     finished_at: datetime | None = None
     description: str
     status: consts.TournamentStatus
+    format: consts.TournamentFormat = consts.TournamentFormat.SINGLE_ELIMINATION
+    seed: int | None = None
     team_title: str | None = None
 
 
@@ -75,6 +78,9 @@ class CreateTournament(BaseModel):
     finished_at: datetime | None = Field(default=datetime.now(None))
     description: str
     status: consts.TournamentStatus = consts.TournamentStatus.OPENED
+    format: consts.TournamentFormat = consts.TournamentFormat.SINGLE_ELIMINATION
+    # Жеребьевка сетки: одинаковый seed при одинаковом составе команд дает одинаковую сетку
+    seed: int = Field(default_factory=lambda: random.getrandbits(31), ge=0, lt=2 ** 31)
 
 
 class TournamentTeam(Team):
@@ -88,6 +94,7 @@ class Match(BaseModel):
     winner_id: int | None = None
     parent_uuid: UUID | None = None
     started_at: datetime | None = None
+    round: int | None = None
 
 
 class UserMatches(BaseModel):
@@ -97,5 +104,57 @@ class UserMatches(BaseModel):
     first_team: str
     second_team: str
     winner_id: int | None = None
-    first_image: str
-    second_image: str
+    first_image: str | None = None
+    second_image: str | None = None
+
+
+class TeamOdds(BaseModel):
+    team_id: int
+    title: str
+    rating: float
+    # вероятность дойти до каждого раунда, последний элемент - вероятность победы в турнире
+    rounds: list[float]
+
+
+class TournamentOdds(BaseModel):
+    tour_id: int
+    simulations: int
+    rounds_count: int
+    teams: list[TeamOdds]
+
+
+class MatchResult(BaseModel):
+    first_team_score: int = Field(ge=0)
+    second_team_score: int = Field(ge=0)
+
+
+class PlayedMatch(BaseModel):
+    match_uuid: str
+    tour_id: int
+    first_team_id: int
+    second_team_id: int
+    first_team_score: int
+    second_team_score: int
+    winner_id: int
+
+
+class Rating(BaseModel):
+    user_id: int
+    nickname: str
+    image_path: str | None = None
+    rating: float
+    wins: int
+    losses: int
+
+
+class Job(BaseModel):
+    job_id: int
+    kind: consts.JobKind
+    status: consts.JobStatus
+    progress: float
+    result: dict | None = None
+    error: str | None = None
+    owner_id: int | None = None
+    created_at: datetime
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
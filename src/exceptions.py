@@ -13,3 +13,8 @@ class NotFoundError(ServiceException):
 class BadRequestError(ServiceException):
     def __init__(self, message: str):
         super().__init__(status_code=400, message=message)
+
+
+class ForbiddenError(ServiceException):
+    def __init__(self, message: str):
+        super().__init__(status_code=403, message=message)
@@ -0,0 +1,93 @@
+import asyncio
+from datetime import datetime
+from typing import AsyncIterator
+
+import consts
+import settings
+from postgres import PostgresManager
+
+MATCHES_QUERY = """
+    select m.match_uuid, m.tour_id, t.title as tournament_title,
+     m.started_at, m.finished_at, m.parent_uuid,
+     m.first_team_id, t1.title as first_team, m.first_team_score,
+     m.second_team_id, t2.title as second_team, m.second_team_score,
+     m.winner_id
+    from matches as m
+    join tournaments as t using(tour_id)
+    left join teams as t1 on m.first_team_id = t1.team_id
+    left join teams as t2 on m.second_team_id = t2.team_id
+    where {where}
+    order by m.started_at, m.match_uuid
+"""
+
+MEDIA_TYPES = {
+    consts.ExportFormat.CSV: 'text/csv',
+    consts.ExportFormat.NDJSON: 'application/x-ndjson',
+}
+
+_semaphore: asyncio.Semaphore | None = None
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(settings.EXPORT_MAX_CONNECTIONS)
+    return _semaphore
+
+
+def _copy_options(export_format: consts.ExportFormat) -> dict:
+    if export_format is consts.ExportFormat.CSV:
+        return {'format': 'csv', 'header': True}
+    # Каждая строка - один JSON-объект. Управляющие символы в качестве кавычки и разделителя
+    # не встречаются в выводе row_to_json, поэтому CSV-режим COPY отдает его без экранирования
+    return {'format': 'csv', 'quote': '\x01', 'delimiter': '\x02'}
+
+
+def _wrap_query(query: str, export_format: consts.ExportFormat) -> str:
+    if export_format is consts.ExportFormat.NDJSON:
+        return f'select row_to_json(row) from ({query}) as row'
+    return query
+
+
+async def _copy(queue: asyncio.Queue, query: str, args: tuple, export_format: consts.ExportFormat):
+    # Выгрузка идет со скоростью клиента, поэтому держит отдельное соединение, а не соединение из пула запросов.
+    # Число таких соединений ограничено, следующие выгрузки ждут освобождения
+    async with _get_semaphore(), PostgresManager() as connection:
+        await connection.copy_from_query(
+            _wrap_query(query, export_format), *args, output=queue.put, **_copy_options(export_format)
+        )
+    await queue.put(None)
+
+
+async def _next_chunk(queue: asyncio.Queue, task: asyncio.Task) -> bytes | None:
+    getter = asyncio.ensure_future(queue.get())
+    done, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+    if getter in done:
+        return getter.result()
+    if task.exception() is not None:
+        getter.cancel()
+        raise task.exception()
+    return await getter
+
+
+async def stream_copy(query: str, *args, export_format: consts.ExportFormat) -> AsyncIterator[bytes]:
+    """Отдает вывод COPY ... TO STDOUT по мере поступления данных от Postgres.
+
+    Очередь ограничена, поэтому медленный клиент притормаживает чтение из базы.
+    """
+    queue: asyncio.Queue[bytes | None] = asyncio.Queue(maxsize=settings.EXPORT_QUEUE_SIZE)
+    task = asyncio.create_task(_copy(queue, query, args, export_format))
+    try:
+        while (chunk := await _next_chunk(queue, task)) is not None:
+            # asyncpg отдает bytearray, а StreamingResponse принимает только bytes и str
+            yield bytes(chunk)
+    finally:
+        task.cancel()
+
+
+def tournament_matches(tour_id: int, export_format: consts.ExportFormat) -> AsyncIterator[bytes]:
+    return stream_copy(MATCHES_QUERY.format(where='m.tour_id = $1'), tour_id, export_format=export_format)
+
+
+def matches_since(since: datetime, export_format: consts.ExportFormat) -> AsyncIterator[bytes]:
+    return stream_copy(MATCHES_QUERY.format(where='m.started_at >= $1'), since, export_format=export_format)
@@ -0,0 +1,221 @@
+import math
+from abc import ABC, abstractmethod
+from typing import Iterator
+from uuid import UUID, uuid5
+
+import consts
+import dto
+from bracket import BRACKET_NAMESPACE, TournamentBracket, draw_key, seeded_order
+
+# Ограничение на число шагов перебора при поиске пар без повторных встреч
+SWISS_BACKTRACK_STEPS_PER_TEAM = 100
+
+
+class TournamentFormat(ABC):
+    """Формат турнира: по командам и уже сохраненным матчам генерирует новые матчи по турам.
+
+    Туры генерируются лениво, поэтому длинное расписание можно отдавать по частям.
+    """
+
+    def __init__(self, tour_id: int, teams: list[dto.Team], seed: int = 0, played: list[dto.Match] | None = None):
+        self.tour_id = tour_id
+        self.teams = seeded_order(teams, seed)
+        self.played = played or []
+        self.draw_key = draw_key(tour_id, self.teams)
+
+    def match_uuid(
+        self,
+        round_number: int,
+        first: dto.TournamentTeam | None,
+        second: dto.TournamentTeam | None
+    ) -> UUID:
+        # Как и в плей-офф, UUID зависит только от турнира, жеребьевки, тура и пары,
+        # поэтому повторная генерация дает те же матчи, что сохранены при материализации
+        pair = '-'.join(str(team.team_id) if team is not None else '' for team in (first, second))
+        return uuid5(BRACKET_NAMESPACE, f'{self.draw_key}:{round_number}:{pair}')
+
+    @abstractmethod
+    def rounds(self) -> Iterator[list[dto.Match]]:
+        ...
+
+    def get_matches(self) -> list[dto.Match]:
+        return [match for round_matches in self.rounds() for match in round_matches]
+
+    def get_round(self, round_number: int) -> list[dto.Match]:
+        # Туры генерируются по возрастанию номера, поэтому следующие за нужным туры не строятся
+        for round_matches in self.rounds():
+            matches = [match for match in round_matches if match.round == round_number]
+            if matches or min((match.round or 0 for match in round_matches), default=0) > round_number:
+                return matches
+        return []
+
+
+class SingleElimination(TournamentFormat):
+    def rounds(self) -> Iterator[list[dto.Match]]:
+        # Сетка плей-офф строится целиком, повторно ее генерировать нельзя
+        if self.played:
+            return
+        yield TournamentBracket(self.tour_id, self.teams).get_matches()
+
+
+class RoundRobin(TournamentFormat):
+    """Круговая система, расписание строится методом вращения (circle method).
+
+    Первая команда остается на месте, остальные сдвигаются по кругу, при нечетном
+    количестве команд добавляется пустой слот, соперник которого пропускает тур.
+    """
+
+    def rounds(self) -> Iterator[list[dto.Match]]:
+        if self.played:
+            return
+
+        slots: list[dto.TournamentTeam | None] = list(self.teams)
+        if len(slots) % 2:
+            slots.append(None)
+        size = len(slots)
+
+        for round_number in range(1, size):
+            matches = []
+            for i in range(size // 2):
+                first, second = slots[i], slots[size - 1 - i]
+                if first is None or second is None:
+                    continue
+                # Чередование сторон для неподвижной команды
+                if i == 0 and round_number % 2 == 0:
+                    first, second = second, first
+                # Участники уже провалидированы, а матчей O(n²), поэтому модель собирается без валидации
+                matches.append(
+                    dto.Match.construct(
+                        match_uuid=self.match_uuid(round_number, first, second),
+                        tour_id=self.tour_id,
+                        participants=[first, second],
+                        round=round_number,
+                    )
+                )
+            yield matches
+            slots = [slots[0], slots[-1], *slots[1:-1]]
+
+
+class Swiss(TournamentFormat):
+    """Швейцарская система: в каждом туре встречаются команды с близким числом побед, повторные встречи исключаются.
+
+    Следующий тур можно построить только после того, как сыграны все матчи предыдущего.
+    """
+
+    @property
+    def rounds_count(self) -> int:
+        return max(1, math.ceil(math.log2(len(self.teams)))) if len(self.teams) > 1 else 0
+
+    def rounds(self) -> Iterator[list[dto.Match]]:
+        if any(match.winner_id is None for match in self.played):
+            return
+        played_rounds = max((match.round or 0 for match in self.played), default=0)
+        if played_rounds >= self.rounds_count:
+            return
+        yield self._next_round(played_rounds + 1)
+
+    def _standings(self) -> tuple[dict[int, int], dict[int, set[int]], set[int]]:
+        scores = {team.team_id: 0 for team in self.teams}
+        opponents: dict[int, set[int]] = {team.team_id: set() for team in self.teams}
+        byes = set()
+        for match in self.played:
+            participants = [team.team_id for team in match.participants if team is not None]
+            if match.winner_id in scores:
+                scores[match.winner_id] += 1
+            if len(participants) == 2:
+                first, second = participants
+                opponents[first].add(second)
+                opponents[second].add(first)
+            elif len(participants) == 1:
+                byes.add(participants[0])
+        return scores, opponents, byes
+
+    def _next_round(self, round_number: int) -> list[dto.Match]:
+        scores, opponents, byes = self._standings()
+        ranked = sorted(self.teams, key=lambda team: (-scores[team.team_id], team.team_number))
+
+        matches = []
+        if len(ranked) % 2:
+            # Пропуск тура (засчитывается как победа) получает худшая команда, еще не пропускавшая тур
+            bye_team = next((team for team in reversed(ranked) if team.team_id not in byes), ranked[-1])
+            ranked.remove(bye_team)
+            matches.append(
+                dto.Match(
+                    match_uuid=self.match_uuid(round_number, bye_team, None),
+                    tour_id=self.tour_id,
+                    participants=[bye_team, None],
+                    winner_id=bye_team.team_id,
+                    round=round_number,
+                )
+            )
+
+        pairs = self.pair(ranked, opponents)
+        if pairs is None:
+            # Без повторных встреч разбить команды на пары не удалось - пары составляются подряд
+            pairs = [(ranked[i], ranked[i + 1]) for i in range(0, len(ranked), 2)]
+        matches.extend(
+            dto.Match.construct(
+                match_uuid=self.match_uuid(round_number, first, second),
+                tour_id=self.tour_id,
+                participants=[first, second],
+                round=round_number,
+            )
+            for first, second in pairs
+        )
+        return matches
+
+    @staticmethod
+    def pair(
+        ranked: list[dto.TournamentTeam],
+        opponents: dict[int, set[int]]
+    ) -> list[tuple[dto.TournamentTeam, dto.TournamentTeam]] | None:
+        """Паросочетание по таблице: каждая свободная команда получает ближайшего по таблице соперника,
+        с которым еще не играла. При тупике последнее решение пересматривается (поиск с возвратом).
+
+        Свободные команды почти всегда идут подряд, поэтому поиск соперника короткий и без возвратов
+        разбиение на пары занимает линейное время. Число шагов перебора ограничено, при превышении
+        возвращается None.
+        """
+        size = len(ranked)
+        partner = [-1] * size
+        stack: list[tuple[int, int]] = []
+        steps_left = SWISS_BACKTRACK_STEPS_PER_TEAM * max(size, 1)
+
+        current, candidate = 0, 1
+        while current < size:
+            played = opponents[ranked[current].team_id]
+            while candidate < size and (partner[candidate] != -1 or ranked[candidate].team_id in played):
+                candidate += 1
+
+            if candidate < size:
+                partner[current], partner[candidate] = candidate, current
+                stack.append((current, candidate))
+                while current < size and partner[current] != -1:
+                    current += 1
+                candidate = current + 1
+            else:
+                steps_left -= 1
+                if not stack or steps_left <= 0:
+                    return None
+                current, candidate = stack.pop()
+                partner[current] = partner[candidate] = -1
+                candidate += 1
+
+        return [(ranked[first], ranked[second]) for first, second in stack]
+
+
+FORMATS: dict[consts.TournamentFormat, type[TournamentFormat]] = {
+    consts.TournamentFormat.SINGLE_ELIMINATION: SingleElimination,
+    consts.TournamentFormat.ROUND_ROBIN: RoundRobin,
+    consts.TournamentFormat.SWISS: Swiss,
+}
+
+
+def get_format(
+    tournament_format: consts.TournamentFormat,
+    tour_id: int,
+    teams: list[dto.Team],
+    seed: int = 0,
+    played: list[dto.Match] | None = None
+) -> TournamentFormat:
+    return FORMATS[tournament_format](tour_id, teams, seed, played)
@@ -0,0 +1,242 @@
+import asyncio
+import contextlib
+import json
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable
+
+import asyncpg
+
+import consts
+import dto
+import rebuild_ratings
+import formats
+import settings
+from bracket import matches_from_records
+from postgres import PostgresManager
+
+logger = logging.getLogger(__name__)
+
+Progress = Callable[[float], Awaitable[None]]
+Handler = Callable[[asyncpg.Connection, dict, Progress], Awaitable[dict | None]]
+
+handlers: dict[consts.JobKind, Handler] = {}
+
+JOB_FAILED_MESSAGE = 'Внутренняя ошибка при выполнении задачи'
+
+
+class JobError(Exception):
+    """Ошибка задачи, текст которой можно показать клиенту."""
+
+
+def handler(kind: consts.JobKind) -> Callable[[Handler], Handler]:
+    def register(function: Handler) -> Handler:
+        handlers[kind] = function
+        return function
+    return register
+
+
+async def claim(connection: asyncpg.Connection) -> asyncpg.Record | None:
+    # SKIP LOCKED позволяет нескольким обработчикам разбирать очередь без блокировок друг друга.
+    # Задачи, брошенные упавшим обработчиком, забираются повторно по истечении JOB_STALE_TIMEOUT,
+    # но не больше JOB_MAX_ATTEMPTS раз
+    return await connection.fetchrow(
+        """
+        update jobs set status = $1, started_at = $3, heartbeat_at = $3, attempts = attempts + 1
+        where job_id = (
+            select job_id from jobs
+            where status = $2 or (
+             status = $1 and heartbeat_at < $3::timestamp - make_interval(secs => $4) and attempts < $5
+            )
+            order by job_id
+            for update skip locked
+            limit 1
+        )
+        returning job_id, kind, params::text
+        """,
+        consts.JobStatus.RUNNING.value, consts.JobStatus.PENDING.value,
+        datetime.now(None), settings.JOB_STALE_TIMEOUT, settings.JOB_MAX_ATTEMPTS
+    )
+
+
+async def fail_abandoned(connection: asyncpg.Connection):
+    # Задачи, которые исчерпали попытки и снова брошены, больше не забираются - они завершаются с ошибкой
+    await connection.execute(
+        """
+        update jobs set status = $2, error = $3, finished_at = $4
+        where status = $1 and heartbeat_at < $4::timestamp - make_interval(secs => $5) and attempts >= $6
+        """,
+        consts.JobStatus.RUNNING.value, consts.JobStatus.FAILED.value,
+        f'Задача прервана: обработчик не отвечал {settings.JOB_MAX_ATTEMPTS} раз(а)',
+        datetime.now(None), settings.JOB_STALE_TIMEOUT, settings.JOB_MAX_ATTEMPTS
+    )
+
+
+async def finish(
+    connection: asyncpg.Connection,
+    job_id: int,
+    status: consts.JobStatus,
+    result: dict | None = None,
+    error: str | None = None
+):
+    await connection.execute(
+        """
+        update jobs set status = $2, result = $3::jsonb, error = $4, finished_at = $5,
+         progress = coalesce($6::real, progress)
+        where job_id = $1
+        """,
+        job_id, status.value, json.dumps(result) if result is not None else None, error, datetime.now(None),
+        1.0 if status is consts.JobStatus.DONE else None
+    )
+
+
+@contextlib.asynccontextmanager
+async def heartbeat(connection: asyncpg.Connection, job_id: int, lock: asyncio.Lock):
+    """Пока выполняется блок, heartbeat_at задачи обновляется каждые JOB_HEARTBEAT_INTERVAL секунд.
+
+    Так долгая задача не считается брошенной, даже если обработчик не сообщает о прогрессе.
+    """
+    async def beat():
+        while True:
+            await asyncio.sleep(settings.JOB_HEARTBEAT_INTERVAL)
+            async with lock:
+                await connection.execute(
+                    'update jobs set heartbeat_at = $2 where job_id = $1', job_id, datetime.now(None)
+                )
+
+    task = asyncio.create_task(beat())
+    try:
+        yield
+    finally:
+        # Отмена только между запросами, чтобы не прервать запрос на общем соединении
+        async with lock:
+            task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+
+async def run_job(connection: asyncpg.Connection, record: asyncpg.Record):
+    job_id = record['job_id']
+    # Соединение обработчика очереди общее для прогресса и heartbeat, запросы по нему не должны пересекаться
+    lock = asyncio.Lock()
+
+    async def progress(value: float):
+        async with lock:
+            await connection.execute(
+                'update jobs set progress = $2, heartbeat_at = $3 where job_id = $1',
+                job_id, min(max(value, 0.0), 1.0), datetime.now(None)
+            )
+
+    try:
+        job_handler = handlers[consts.JobKind(record['kind'])]
+        # Задача выполняется на отдельном соединении, чтобы ее транзакции не скрывали прогресс
+        async with heartbeat(connection, job_id, lock), PostgresManager() as job_connection:
+            result = await job_handler(job_connection, json.loads(record['params']), progress)
+    except asyncio.CancelledError:
+        raise
+    except Exception as exc:
+        # Полный traceback пишется только в лог, клиенту доступно короткое сообщение
+        logger.exception('Job %s failed', job_id)
+        error = str(exc) if isinstance(exc, JobError) else JOB_FAILED_MESSAGE
+        await finish(connection, job_id, consts.JobStatus.FAILED, error=error)
+    else:
+        await finish(connection, job_id, consts.JobStatus.DONE, result=result)
+
+
+async def _wait(stop: asyncio.Event):
+    try:
+        await asyncio.wait_for(stop.wait(), timeout=settings.JOB_POLL_INTERVAL)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def worker(stop: asyncio.Event | None = None):
+    stop = stop or asyncio.Event()
+    while not stop.is_set():
+        try:
+            async with PostgresManager() as connection:
+                while not stop.is_set():
+                    record = await claim(connection)
+                    if record is not None:
+                        await run_job(connection, record)
+                    else:
+                        await fail_abandoned(connection)
+                        await _wait(stop)
+        except (OSError, asyncpg.PostgresConnectionError, asyncpg.InterfaceError):
+            # Потеря соединения с базой не должна останавливать обработчик
+            logger.exception('Job worker connection failed')
+            await _wait(stop)
+
+
+@handler(consts.JobKind.MATERIALIZE_BRACKET)
+async def materialize_bracket(connection: asyncpg.Connection, params: dict, progress: Progress) -> dict:
+    tour_id = params['tour_id']
+    async with connection.transaction():
+        # Блокировка турнира защищает от повторной материализации параллельной задачей
+        tournament = await connection.fetchrow(
+            'select format, seed from tournaments where tour_id = $1 for update', tour_id
+        )
+        if tournament is None:
+            raise JobError(f'Турнира с ID={tour_id} не существует')
+
+        records = await connection.fetch(
+            """
+            select * from teams
+            join tournament_teams using (team_id)
+            where tournament_teams.tournament_id = $1
+            """,
+            tour_id
+        )
+        teams = [dto.Team.parse_obj(dict(record.items())) for record in records]
+        if len(teams) < 2:
+            raise JobError('Невозможно создать сетку из одной команды')
+
+        played = matches_from_records(
+            tour_id,
+            await connection.fetch(
+                """
+                select match_uuid, first_team_id, second_team_id, winner_id, parent_uuid, started_at, round
+                from matches where tour_id = $1
+                """,
+                tour_id
+            ),
+            teams
+        )
+        # Для швейцарской системы формируется следующий тур, для остальных форматов - вся сетка
+        matches = formats.get_format(
+            consts.TournamentFormat(tournament['format']), tour_id, teams, tournament['seed'], played
+        ).get_matches()
+        if not matches:
+            raise JobError(f'Для турнира ID={tour_id} нет новых матчей: сетка уже сформирована или тур не доигран')
+        await progress(0.5)
+
+        now = datetime.now(None)
+        # Ссылки на родительские матчи проверяются в конце команды, поэтому порядок строк не важен
+        await connection.execute(
+            """
+            insert into matches (
+             match_uuid, tour_id, first_team_id, second_team_id, parent_uuid, started_at, round, winner_id
+            )
+            select match_uuid, $2, first_team_id, second_team_id, parent_uuid, $6, round, winner_id
+            from unnest($1::text[], $3::integer[], $4::integer[], $5::text[], $7::integer[], $8::integer[])
+             as t(match_uuid, first_team_id, second_team_id, parent_uuid, round, winner_id)
+            """,
+            [str(match.match_uuid) for match in matches],
+            tour_id,
+            [match.participants[0].team_id if match.participants[0] else None for match in matches],
+            [match.participants[1].team_id if match.participants[1] else None for match in matches],
+            [str(match.parent_uuid) if match.parent_uuid else None for match in matches],
+            now,
+            [match.round for match in matches],
+            [match.winner_id for match in matches],
+        )
+        await connection.execute(
+            'update tournaments set status = $2 where tour_id = $1',
+            tour_id, consts.TournamentStatus.ACTIVE.value
+        )
+    return {'tour_id': tour_id, 'matches': len(matches)}
+
+
+@handler(consts.JobKind.RATING_BACKFILL)
+async def rating_backfill(connection: asyncpg.Connection, params: dict, progress: Progress) -> dict:
+    return {'players': await rebuild_ratings.rebuild(connection, progress)}
@@ -1,23 +1,41 @@
+import asyncio
 from contextlib import asynccontextmanager
+from datetime import datetime
 
 import uvicorn
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Query, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi_jwt_auth import AuthJWT
 from fastapi_jwt_auth.exceptions import AuthJWTException
 
+import consts
 import dto
 import exceptions
+import export
+import formats
+import jobs
+import media
+import odds
 import settings
-from bracket import TournamentBracket
-from postgres import pg, migrate, UserTable, Tournaments, Matches, TeamsTable
+from bracket import matches_from_records
+from cache import TTLCache
+from postgres import pg, migrate, UserTable, Tournaments, Matches, TeamsTable, Ratings, JobsTable
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
-    await migrate()
+    # При запуске через src/serve.py миграции выполняются один раз до запуска процессов
+    if settings.RUN_MIGRATIONS:
+        await migrate()
+    await pg.connect()
+    stop = asyncio.Event()
+    workers = [asyncio.create_task(jobs.worker(stop)) for _ in range(settings.JOB_WORKERS)]
     yield
+    stop.set()
+    await asyncio.gather(*workers, return_exceptions=True)
+    media.shutdown()
+    await pg.disconnect()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -85,7 +103,7 @@ async def login(user: dto.UserLogin, authorize: AuthJWT = Depends()) -> dto.User
     # при совпадении/несовпадении логина или пароля
     async with pg:
         existing = await UserTable.get_by_login(user.login, raise_exception=False)
-    if existing is None or not UserTable.verify(user.password, existing.password):
+    if existing is None or not await asyncio.to_thread(UserTable.verify, user.password, existing.password):
         raise exceptions.BadRequestError('Неправильно введен логин или пароль')
     set_tokens_in_cookies(authorize, existing.login)
     return dto.User.parse_obj(existing.dict())
@@ -99,6 +117,17 @@ async def user_profile(authorize: AuthJWT = Depends()) -> dto.User:
         return await UserTable.get_by_login(user_login)
 
 
+@app.post('/users/me/image', response_model=dto.User)
+async def upload_user_image(image: UploadFile, authorize: AuthJWT = Depends()) -> dto.User:
+    authorize.jwt_required()
+    user_login = authorize.get_jwt_subject()
+    async with pg:
+        user = await UserTable.get_by_login(user_login)
+    image_path = await media.save_image(image)
+    async with pg:
+        return await UserTable.set_image(user.user_id, image_path)
+
+
 @app.get('/users/{user_id}', response_model=dto.User)
 async def user_detail(user_id: int) -> dto.User:
     async with pg:
@@ -120,6 +149,56 @@ async def create_team(team: dto.CreateTeam) -> dto.Team:
         return await TeamsTable.add(team)
 
 
+users_search_cache = TTLCache(maxsize=settings.SEARCH_CACHE_SIZE, ttl=settings.SEARCH_CACHE_TTL)
+teams_search_cache = TTLCache(maxsize=settings.SEARCH_CACHE_SIZE, ttl=settings.SEARCH_CACHE_TTL)
+
+
+async def cached_search(cache: TTLCache, search, query: str, limit: int) -> list:
+    query = query.strip().lower()
+    if not query:
+        return []
+
+    cacheable = len(query) <= settings.SEARCH_CACHE_PREFIX_LENGTH
+    if cacheable and (result := cache.get((query, limit))) is not None:
+        return result
+
+    async with pg:
+        result = await search(query, limit)
+    if cacheable:
+        cache.set((query, limit), result)
+    return result
+
+
+@app.get('/search/users', response_model=list[dto.User])
+async def search_users(
+    q: str = Query(min_length=1, max_length=100),
+    limit: int = Query(default=10, ge=1, le=settings.SEARCH_MAX_LIMIT)
+) -> list[dto.User]:
+    return await cached_search(users_search_cache, UserTable.search, q, limit)
+
+
+@app.get('/search/teams', response_model=list[dto.Team])
+async def search_teams(
+    q: str = Query(min_length=1, max_length=100),
+    limit: int = Query(default=10, ge=1, le=settings.SEARCH_MAX_LIMIT)
+) -> list[dto.Team]:
+    return await cached_search(teams_search_cache, TeamsTable.search, q, limit)
+
+
+@app.post('/teams/{team_id}/image', response_model=dto.Team)
+async def upload_team_image(team_id: int, image: UploadFile, authorize: AuthJWT = Depends()) -> dto.Team:
+    authorize.jwt_required()
+    user_login = authorize.get_jwt_subject()
+    async with pg:
+        user = await UserTable.get_by_login(user_login)
+        team = await TeamsTable.get_by_id(team_id)
+    if user.user_id not in (team.first_participant_id, team.second_participant_id):
+        raise exceptions.ForbiddenError('Изображение команды может изменить только ее участник')
+    image_path = await media.save_image(image)
+    async with pg:
+        return await TeamsTable.set_image(team_id, image_path)
+
+
 @app.get('/teams/{team_id}', response_model=dto.Team)
 async def team_info(team_id: int) -> dto.Team:
     async with pg:
@@ -158,39 +237,170 @@ async def add_tournament(tournament: dto.CreateTournament, authorize: AuthJWT =
 
 
 @app.get('/tournaments/{tour_id}/bracket', response_model=list[dto.Match])
-async def tournament_bracket(tour_id: int) -> list[dto.Match]:
-    async with pg:
-        teams_records = await pg.fetch(
-            """
-                SELECT * FROM teams
-                JOIN tournament_teams USING (team_id)
-                WHERE tournament_teams.tournament_id = $1
-            """,
-            tour_id
-        )
-
-    if not teams_records:
+async def tournament_bracket(
+    tour_id: int,
+    round_number: int | None = Query(default=None, ge=1, alias='round')
+) -> list[dto.Match]:
+    async with pg:
+        bracket_settings = await Tournaments.get_bracket_settings(tour_id)
+        teams = await Tournaments.get_bracket_teams(tour_id)
+        match_records = await Matches.get_by_tournament(tour_id)
+
+    if not teams or bracket_settings is None:
         return []
+    tournament_format, seed = bracket_settings
 
-    if len(teams_records) < 2:
+    if len(teams) < 2:
         raise exceptions.BadRequestError('Невозможно создать сетку из одной команды')
 
-    teams = [dto.Team(**dict(record.items())) for record in teams_records]
-
-    bracket = TournamentBracket(tour_id=tour_id, teams=teams)
-    matches = bracket.get_matches()
+    # Сохраненные матчи дополняются теми, которые формат турнира может построить по ним
+    played = matches_from_records(tour_id, match_records, teams)
+    engine = formats.get_format(tournament_format, tour_id, teams, seed, played)
+    # Круговой турнир содержит O(n²) матчей: расписание можно запрашивать по турам,
+    # а генерация не занимает цикл событий
+    if round_number is None:
+        matches = played + await asyncio.to_thread(engine.get_matches)
+    else:
+        played = [match for match in played if match.round == round_number]
+        matches = played + await asyncio.to_thread(engine.get_round, round_number)
     for match in matches:
         if match.participants and match.participants[1] is None:
             match.participants.pop(1)
         if match.participants and match.participants[0] is None:
             match.participants.pop(0)
+        for team in match.participants:
+            team.image_path = media.thumbnail_url(team.image_path)
     return matches
 
 
+@app.post('/tournaments/{tour_id}/bracket', response_model=dto.Job)
+async def materialize_bracket(tour_id: int, authorize: AuthJWT = Depends()) -> dto.Job:
+    authorize.jwt_required()
+    user_login = authorize.get_jwt_subject()
+    async with pg:
+        user = await UserTable.get_by_login(user_login)
+        owner_id = await Tournaments.get_owner_id(tour_id)
+        if owner_id is None:
+            raise exceptions.NotFoundError(f"Турнира с ID={tour_id} не существует")
+        if owner_id != user.user_id:
+            raise exceptions.ForbiddenError('Сформировать сетку может только создатель турнира')
+        return await JobsTable.enqueue(consts.JobKind.MATERIALIZE_BRACKET, {'tour_id': tour_id}, user.user_id)
+
+
+@app.get('/tournaments/{tour_id}/odds', response_model=dto.TournamentOdds)
+async def tournament_odds(tour_id: int) -> dto.TournamentOdds:
+    async with pg:
+        bracket_settings = await Tournaments.get_bracket_settings(tour_id)
+        if bracket_settings is None:
+            raise exceptions.NotFoundError(f"Турнира с ID={tour_id} не существует")
+        tournament_format, seed = bracket_settings
+        if tournament_format is not consts.TournamentFormat.SINGLE_ELIMINATION:
+            raise exceptions.BadRequestError('Шансы рассчитываются только для турниров по олимпийской системе')
+        teams = await Tournaments.get_bracket_teams(tour_id)
+        if len(teams) < 2:
+            raise exceptions.BadRequestError('Невозможно рассчитать шансы для турнира без сетки')
+        match_records = await Matches.get_by_tournament(tour_id)
+        ratings = await Ratings.get_team_ratings([team.team_id for team in teams])
+
+    if match_records:
+        matches = matches_from_records(tour_id, match_records, teams)
+    else:
+        matches = formats.SingleElimination(tour_id, teams, seed).get_matches()
+
+    return await odds.get_odds(tour_id, matches, teams, ratings, settings.ODDS_SIMULATIONS)
+
+
+@app.post('/jobs/rating-backfill', response_model=dto.Job)
+async def rating_backfill(authorize: AuthJWT = Depends()) -> dto.Job:
+    authorize.jwt_required()
+    user_login = authorize.get_jwt_subject()
+    if user_login not in settings.ADMIN_LOGINS:
+        raise exceptions.ForbiddenError('Пересчет рейтингов доступен только администраторам')
+    async with pg:
+        user = await UserTable.get_by_login(user_login)
+        return await JobsTable.enqueue(consts.JobKind.RATING_BACKFILL, {}, user.user_id)
+
+
+@app.get('/jobs/{job_id}', response_model=dto.Job)
+async def job_status(job_id: int, authorize: AuthJWT = Depends()) -> dto.Job:
+    authorize.jwt_required()
+    user_login = authorize.get_jwt_subject()
+    async with pg:
+        user = await UserTable.get_by_login(user_login)
+        job = await JobsTable.get_by_id(job_id)
+    if job.owner_id != user.user_id and user_login not in settings.ADMIN_LOGINS:
+        raise exceptions.ForbiddenError('Статус задачи доступен только ее создателю')
+    return job
+
+
+def export_response(content, filename: str, export_format: consts.ExportFormat) -> StreamingResponse:
+    return StreamingResponse(
+        content,
+        media_type=export.MEDIA_TYPES[export_format],
+        headers={'Content-Disposition': f'attachment; filename="{filename}.{export_format.value}"'}
+    )
+
+
+@app.get('/tournaments/{tour_id}/export', response_class=StreamingResponse)
+async def export_tournament(
+    tour_id: int,
+    export_format: consts.ExportFormat = Query(default=consts.ExportFormat.CSV, alias='format')
+) -> StreamingResponse:
+    async with pg:
+        if await Tournaments.get(tour_id) is None:
+            raise exceptions.NotFoundError(f"Турнира с ID={tour_id} не существует")
+    return export_response(
+        export.tournament_matches(tour_id, export_format), f'tournament-{tour_id}', export_format
+    )
+
+
+@app.get('/export/matches', response_class=StreamingResponse)
+async def export_matches(
+    since: datetime,
+    export_format: consts.ExportFormat = Query(default=consts.ExportFormat.CSV, alias='format'),
+    authorize: AuthJWT = Depends()
+) -> StreamingResponse:
+    authorize.jwt_required()
+    if authorize.get_jwt_subject() not in settings.ADMIN_LOGINS:
+        raise exceptions.ForbiddenError('Выгрузка всех матчей доступна только администраторам')
+    return export_response(
+        export.matches_since(since, export_format), f'matches-{since:%Y%m%d}', export_format
+    )
+
+
 @app.get('/users/{user_id}/history-matches', response_model=list[dto.UserMatches])
 async def history_matches(user_id: int) -> list[dto.UserMatches]:
     async with pg:
-        return await Matches.history_user(user_id)
+        records = await Matches.history_user(user_id)
+    history = [dto.UserMatches.parse_obj(dict(record.items())) for record in records]
+    for match in history:
+        match.first_image = media.thumbnail_url(match.first_image)
+        match.second_image = media.thumbnail_url(match.second_image)
+    return history
+
+
+@app.post('/matches/{match_uuid}/result', response_model=dto.PlayedMatch)
+async def match_result(match_uuid: str, result: dto.MatchResult, authorize: AuthJWT = Depends()) -> dto.PlayedMatch:
+    authorize.jwt_required()
+    user_login = authorize.get_jwt_subject()
+    async with pg:
+        user = await UserTable.get_by_login(user_login)
+        owner_id = await Matches.get_owner_id(match_uuid)
+        if owner_id is None:
+            raise exceptions.NotFoundError(f'Матч {match_uuid} не найден')
+        if owner_id != user.user_id:
+            raise exceptions.ForbiddenError('Результат матча может записать только создатель турнира')
+        return await Matches.record_result(match_uuid, result)
+
+
+@app.get('/leaderboard', response_model=list[dto.Rating])
+async def leaderboard(
+    limit: int = Query(default=50, ge=1, le=100),
+    after_rating: float | None = None,
+    after_user_id: int | None = None
+) -> list[dto.Rating]:
+    async with pg:
+        return await Ratings.leaderboard(limit, after_rating, after_user_id)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,109 @@
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from fastapi import UploadFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+import exceptions
+import settings
+
+CHUNK_SIZE = 64 * 1024
+THUMBNAIL_RE = re.compile(r'^(?P<prefix>.+/[0-9a-f]{64})_\d+\.jpg$')
+
+_executor: ProcessPoolExecutor | None = None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.THUMBNAIL_WORKERS)
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+
+
+def _relative_path(digest: str, size: int) -> str:
+    return f'{digest[:2]}/{digest}_{size}.jpg'
+
+
+def thumbnail_url(image_path: str | None, size: int | None = None) -> str | None:
+    """Путь к миниатюре нужного размера (по умолчанию - самой маленькой) для загруженного изображения.
+
+    Пути, указанные вручную, не меняются.
+    """
+    if image_path is None:
+        return None
+    match = THUMBNAIL_RE.match(image_path)
+    if match is None:
+        return image_path
+    return f'{match["prefix"]}_{size or min(settings.THUMBNAIL_SIZES)}.jpg'
+
+
+def make_thumbnails(source: str, targets: dict[int, str]):
+    # Выполняется в отдельном процессе
+    try:
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            for size, target in targets.items():
+                if os.path.exists(target):
+                    continue
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+                with os.fdopen(fd, 'wb') as file:
+                    thumbnail.save(file, 'JPEG', quality=85, optimize=True)
+                os.replace(tmp_path, target)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as exc:
+        raise ValueError(str(exc)) from None
+
+
+async def _save_upload(upload: UploadFile, directory: Path) -> tuple[str, str]:
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.upload')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            while chunk := await upload.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > settings.IMAGE_MAX_SIZE:
+                    raise exceptions.BadRequestError(
+                        f'Размер изображения не должен превышать {settings.IMAGE_MAX_SIZE} байт'
+                    )
+                digest.update(chunk)
+                file.write(chunk)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest()
+
+
+async def save_image(upload: UploadFile) -> str:
+    """Сохраняет изображение и миниатюры в MEDIA_ROOT и возвращает URL самой большой миниатюры.
+
+    Файлы адресуются хэшем содержимого, поэтому одинаковые изображения хранятся один раз
+    и могут кэшироваться бессрочно.
+    """
+    media_root = Path(settings.MEDIA_ROOT)
+    upload_dir = Path(settings.UPLOAD_TMP_DIR or tempfile.gettempdir())
+    upload_dir.mkdir(parents=True, exist_ok=True)
+
+    tmp_path, digest = await _save_upload(upload, upload_dir)
+    targets = {size: str(media_root / _relative_path(digest, size)) for size in settings.THUMBNAIL_SIZES}
+    try:
+        await asyncio.get_running_loop().run_in_executor(_get_executor(), make_thumbnails, tmp_path, targets)
+    except ValueError:
+        raise exceptions.BadRequestError('Файл не является изображением')
+    finally:
+        os.unlink(tmp_path)
+
+    return settings.MEDIA_URL + _relative_path(digest, max(settings.THUMBNAIL_SIZES))
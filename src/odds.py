@@ -0,0 +1,178 @@
+import asyncio
+
+import numpy as np
+
+import dto
+from rating import ELO_SCALE
+
+# Симуляции разыгрываются блоками, чтобы память не росла вместе с их количеством
+SIMULATION_CHUNK = 10_000
+
+
+class BracketSimulator:
+    """Monte Carlo симуляция оставшейся части турнира по олимпийской системе.
+
+    Сетка один раз переводится в массивы, после чего все матчи одного раунда
+    разыгрываются сразу во всех симуляциях.
+    """
+
+    def __init__(self, matches: list[dto.Match], ratings: dict[int, float]):
+        self.team_ids = sorted(ratings)
+        team_index = {team_id: i for i, team_id in enumerate(self.team_ids)}
+        # Отдельный индекс для пустого слота (bye), который всегда проигрывает
+        self.bye = len(self.team_ids)
+        self.ratings = np.array([ratings[team_id] for team_id in self.team_ids] + [-np.inf])
+
+        match_index = {match.match_uuid: i for i, match in enumerate(matches)}
+        parents = [match_index.get(match.parent_uuid) for match in matches]
+        children: list[list[int]] = [[] for _ in matches]
+        for i, parent in enumerate(parents):
+            if parent is not None:
+                children[parent].append(i)
+
+        self.slot_team = np.full((len(matches), 2), self.bye, dtype=np.int32)
+        self.slot_child = np.full((len(matches), 2), -1, dtype=np.int32)
+        self.winner = np.full(len(matches), -1, dtype=np.int32)
+        for i, match in enumerate(matches):
+            # Победитель сыгранного дочернего матча уже записан в участники, его место занимает дочерний матч
+            advanced = {matches[child].winner_id for child in children[i]}
+            slots = [
+                ('team', team_index[team.team_id])
+                for team in match.participants if team is not None and team.team_id not in advanced
+            ]
+            slots += [('child', child) for child in children[i]]
+            if len(slots) > 2:
+                raise ValueError(f'Матч {match.match_uuid} имеет больше двух участников')
+            for side, (kind, value) in enumerate(slots):
+                if kind == 'team':
+                    self.slot_team[i, side] = value
+                else:
+                    self.slot_child[i, side] = value
+            if match.winner_id is not None and match.winner_id in team_index:
+                self.winner[i] = team_index[match.winner_id]
+
+        # Раунд матча определяется расстоянием до финала: матч, оба участника которого
+        # пропустили первый раунд, не имеет дочерних матчей, но играется во втором раунде
+        depth = np.zeros(len(matches), dtype=np.int32)
+        for i in reversed(self._children_first_order(children)):
+            if parents[i] is not None:
+                depth[i] = depth[parents[i]] + 1
+        self.rounds_count = int(depth.max(initial=-1)) + 1
+        rounds = self.rounds_count - depth
+        self.rounds = [np.flatnonzero(rounds == r) for r in range(1, self.rounds_count + 1)]
+        # Позиция матча в своем раунде: по ней берется победитель из результатов предыдущего раунда
+        self.position = np.zeros(len(matches), dtype=np.int32)
+        for current in self.rounds:
+            self.position[current] = np.arange(len(current))
+
+    @staticmethod
+    def _children_first_order(children: list[list[int]]) -> list[int]:
+        order, visited = [], [False] * len(children)
+        for root in range(len(children)):
+            stack = [(root, False)]
+            while stack:
+                node, expanded = stack.pop()
+                if expanded:
+                    order.append(node)
+                elif not visited[node]:
+                    visited[node] = True
+                    stack.append((node, True))
+                    stack.extend((child, False) for child in children[node])
+        return order
+
+    def simulate(self, simulations: int, seed: int | None = None) -> np.ndarray:
+        """Возвращает матрицу (команды x раунды + 1) вероятностей дойти до раунда.
+
+        Последний столбец - вероятность победы в турнире.
+        """
+        rng = np.random.default_rng(seed)
+        # Сколько раз команда сыграла в раунде (последний столбец - сколько раз выиграла турнир)
+        counts = np.zeros((self.bye + 1, self.rounds_count + 1), dtype=np.int64)
+        for start in range(0, simulations, SIMULATION_CHUNK):
+            self._simulate_chunk(min(SIMULATION_CHUNK, simulations - start), rng, counts)
+
+        probabilities = counts[:self.bye] / simulations
+        # До первого раунда доходят все команды, в том числе пропускающие его
+        probabilities[:, 0] = 1.0
+        return probabilities
+
+    def _simulate_chunk(self, simulations: int, rng: np.random.Generator, counts: np.ndarray):
+        # Хранятся только победители предыдущего раунда: дочерние матчи всегда играются в нем
+        previous = np.empty((0, simulations), dtype=np.int32)
+        for round_number, current in enumerate(self.rounds, start=1):
+            sides = np.empty((2, len(current), simulations), dtype=np.int32)
+            for side in range(2):
+                sides[side] = self.slot_team[current, side][:, None]
+                child = self.slot_child[current, side]
+                has_child = child >= 0
+                sides[side, has_child] = previous[self.position[child[has_child]]]
+            counts[:, round_number - 1] += np.bincount(sides.ravel(), minlength=self.bye + 1)
+
+            first, second = sides
+            with np.errstate(invalid='ignore', over='ignore'):
+                diff = (self.ratings[second] - self.ratings[first]) / ELO_SCALE
+                first_win_probability = 1.0 / (1.0 + np.power(10.0, diff))
+            result = np.where(rng.random(first.shape) < first_win_probability, first, second)
+
+            recorded = self.winner[current] >= 0
+            result[recorded] = self.winner[current][recorded][:, None]
+            previous = result
+
+        if self.rounds:
+            counts[:, self.rounds_count] += np.bincount(previous.ravel(), minlength=self.bye + 1)
+
+
+_cache: dict[int, tuple[tuple, dto.TournamentOdds]] = {}
+
+
+def _state_key(matches: list[dto.Match], ratings: dict[int, float]) -> tuple:
+    return (
+        tuple(sorted(
+            (str(match.match_uuid), match.winner_id) for match in matches if match.winner_id is not None
+        )),
+        tuple(sorted(ratings.items())),
+    )
+
+
+def _compute_odds(
+    tour_id: int,
+    matches: list[dto.Match],
+    teams: list[dto.Team],
+    ratings: dict[int, float],
+    simulations: int
+) -> dto.TournamentOdds:
+    simulator = BracketSimulator(matches, ratings)
+    probabilities = simulator.simulate(simulations)
+    titles = {team.team_id: team.title for team in teams}
+    return dto.TournamentOdds(
+        tour_id=tour_id,
+        simulations=simulations,
+        rounds_count=simulator.rounds_count,
+        teams=[
+            dto.TeamOdds(
+                team_id=team_id,
+                title=titles[team_id],
+                rating=ratings[team_id],
+                rounds=probabilities[i].tolist()
+            )
+            for i, team_id in enumerate(simulator.team_ids)
+        ]
+    )
+
+
+async def get_odds(
+    tour_id: int,
+    matches: list[dto.Match],
+    teams: list[dto.Team],
+    ratings: dict[int, float],
+    simulations: int
+) -> dto.TournamentOdds:
+    # Пересчет происходит только при изменении состояния сетки (новый результат матча)
+    key = _state_key(matches, ratings)
+    cached = _cache.get(tour_id)
+    if cached is not None and cached[0] == key and cached[1].simulations == simulations:
+        return cached[1]
+
+    odds = await asyncio.to_thread(_compute_odds, tour_id, matches, teams, ratings, simulations)
+    _cache[tour_id] = (key, odds)
+    return odds
@@ -1,3 +1,6 @@
+import asyncio
+import json
+from contextvars import ContextVar, Token
 from datetime import datetime
 from enum import Enum
 from functools import wraps
@@ -7,8 +10,10 @@ import asyncpg
 from passlib.context import CryptContext
 from pydantic import BaseModel
 
+import consts
 import dto
 import exceptions
+import rating
 import settings
 
 DecoratedFunction = TypeVar('DecoratedFunction', bound=Callable[..., Any])
@@ -26,20 +31,60 @@ def connection_check(function: DecoratedFunction) -> DecoratedFunction:
     return wrapper
 
 
+def like_pattern(prefix: str) -> str:
+    escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'{escaped}%'
+
+
 class PostgresManager:
     def __init__(self, dsn: str | None = None):
         self.dsn: str = dsn or settings.POSTGRES_DSN
+        self.pool: asyncpg.Pool | None = None
+        # Соединение хранится в контексте задачи, поэтому параллельные запросы не перетирают его друг у друга
+        self._connection: ContextVar[asyncpg.Connection | None] = ContextVar(
+            f'postgres_connection_{id(self)}', default=None
+        )
+        # Токены вложенных `async with`: при выходе восстанавливается соединение внешнего блока
+        self._tokens: ContextVar[tuple[Token, ...]] = ContextVar(f'postgres_tokens_{id(self)}', default=())
+
+    @property
+    def __connection(self) -> asyncpg.Connection | None:
+        return self._connection.get()
 
     @property
     def connected(self) -> bool:
         return bool(self.__connection and not self.__connection.is_closed())
 
+    async def connect(self, min_size: int | None = None, max_size: int | None = None):
+        """Создает пул соединений. Без пула каждый `async with` открывает отдельное соединение."""
+        self.pool = await asyncpg.create_pool(
+            self.dsn,
+            min_size=min_size or settings.POSTGRES_POOL_MIN_SIZE,
+            max_size=max_size or settings.POSTGRES_POOL_MAX_SIZE,
+        )
+
+    async def disconnect(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
     async def __aenter__(self):
-        self.__connection: asyncpg.Connection = await asyncpg.connect(self.dsn)
-        return self.__connection
+        if self.pool is not None:
+            connection = await self.pool.acquire()
+        else:
+            connection = await asyncpg.connect(self.dsn)
+        self._tokens.set(self._tokens.get() + (self._connection.set(connection),))
+        return connection
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.__connection.close()
+        connection = self.__connection
+        *tokens, token = self._tokens.get()
+        self._tokens.set(tuple(tokens))
+        self._connection.reset(token)
+        if self.pool is not None:
+            await self.pool.release(connection)
+        else:
+            await connection.close()
 
     async def execute(self, query: str, *args, timeout: int | None = None):
         return await self.__connection.execute(query, *args, timeout=timeout)
@@ -58,6 +103,9 @@ class PostgresManager:
             query, *args, timeout=timeout, record_class=record_class
         )
 
+    def transaction(self) -> asyncpg.transaction.Transaction:
+        return self.__connection.transaction()
+
     async def fetch(
         self,
         query: str,
@@ -208,6 +256,9 @@ async def migrate():
             create unique index if not exists login_unique on users(login); 
             create unique index if not exists nickname_unique on users(nickname); 
             
+            create extension if not exists pg_trgm;
+            create index if not exists users_nickname_trgm on users using gin (nickname gin_trgm_ops);
+            
             create table if not exists teams (
                 team_id serial primary key,
                 title varchar(128) not null,
@@ -220,6 +271,8 @@ async def migrate():
                 constraint second_participant_fk foreign key (second_participant_id) references users (user_id)
             );
             
+            create index if not exists teams_title_trgm on teams using gin (title gin_trgm_ops);
+            
             create table if not exists tournaments (
                 tour_id serial primary key,
                 title varchar not null,
@@ -252,6 +305,51 @@ async def migrate():
                 constraint parent_match_fk foreign key (parent_uuid) references matches (match_uuid) on delete restrict
             );
             
+            alter table matches add column if not exists finished_at timestamp;
+            alter table matches add column if not exists round integer;
+            -- Матчи плей-офф, сохраненные без раунда: раунд считается по расстоянию до финала
+            with recursive depth as (
+                select match_uuid, tour_id, 0 as depth from matches where parent_uuid is null and round is null
+                union all
+                select m.match_uuid, m.tour_id, depth.depth + 1
+                from matches as m join depth on m.parent_uuid = depth.match_uuid
+            )
+            update matches set round = rounds.total - depth.depth
+            from depth join (select tour_id, max(depth) + 1 as total from depth group by tour_id) as rounds using (tour_id)
+            where matches.match_uuid = depth.match_uuid and matches.round is null;
+            alter table tournaments add column if not exists format varchar not null default 'SINGLE_ELIMINATION';
+            alter table tournaments add column if not exists seed bigint not null default floor(random() * 2147483647);
+
+            create table if not exists ratings (
+                user_id integer primary key,
+                rating double precision not null,
+                wins integer not null default 0,
+                losses integer not null default 0,
+                updated_at timestamp not null,
+
+                constraint user_fk foreign key (user_id) references users (user_id) on delete cascade
+            );
+            create index if not exists ratings_leaderboard on ratings(rating, user_id);
+
+            create table if not exists jobs (
+                job_id serial primary key,
+                kind varchar not null,
+                params jsonb not null,
+                status varchar not null,
+                progress real not null default 0,
+                result jsonb,
+                error text,
+                attempts integer not null default 0,
+                owner_id integer,
+                created_at timestamp not null,
+                started_at timestamp,
+                heartbeat_at timestamp,
+                finished_at timestamp,
+
+                constraint owner_fk foreign key (owner_id) references users (user_id) on delete set null
+            );
+            create index if not exists jobs_queue on jobs(status, job_id) where status in ('PENDING', 'RUNNING');
+
             create table if not exists tournament_teams (
                 team_id integer not null,
                 tournament_id integer not null,
@@ -293,13 +391,42 @@ class UserTable(Table):
             raise exceptions.NotFoundError(f'Пользователь с ID: {user_id} не найден.')
         return user
 
+    @classmethod
+    @connection_check
+    async def search(cls, query: str, limit: int) -> list[dto.User]:
+        # Сначала совпадения по префиксу, затем похожие по триграммам (индекс users_nickname_trgm)
+        records = await pg.fetch(
+            """
+            select user_id, login, nickname, image_path
+            from users
+            where nickname ilike $1 or nickname % $2
+            order by nickname ilike $1 desc, similarity(nickname, $2) desc, nickname
+            limit $3
+            """,
+            like_pattern(query), query, limit
+        )
+        return [dto.User.parse_obj(dict(record.items())) for record in records]
+
     @classmethod
     @connection_check
     async def add(cls, user: dto.UserRegistration) -> dto.User:
-        user.password = cls.get_hashed_password(user.password)
+        # bcrypt занимает десятки миллисекунд процессора, поэтому выполняется вне event loop
+        user.password = await asyncio.to_thread(cls.get_hashed_password, user.password)
         user.created_at = datetime.now(None)
         return await cls._add(user)
 
+    @classmethod
+    @connection_check
+    async def set_image(cls, user_id: int, image_path: str) -> dto.User:
+        record = await pg.fetchrow(
+            """
+            update users set image_path = $2 where user_id = $1
+            returning user_id, login, nickname, image_path
+            """,
+            user_id, image_path
+        )
+        return dto.User.parse_obj(dict(record.items()))
+
     @classmethod
     @connection_check
     async def exists(cls, login: str, nickname: str) -> bool:
@@ -321,7 +448,7 @@ class Tournaments(Table):
         return await pg.fetch(
             """
                 SELECT tour_id, tournaments.title as title, started_at,
-                finished_at, description, status, teams.title as team_title 
+                finished_at, description, status, format, seed, teams.title as team_title 
                 from tournaments 
                 left join teams on tournaments.winner_id = teams.team_id
             """,
@@ -333,7 +460,7 @@ class Tournaments(Table):
         return await pg.fetchrow(
             """
                 SELECT tour_id, tournaments.title as title, started_at,
-                finished_at, description, status, teams.title as team_title 
+                finished_at, description, status, format, seed, teams.title as team_title 
                 from tournaments 
                 left join teams on tournaments.winner_id = teams.team_id
                 where tour_id = $1
@@ -355,6 +482,30 @@ class Tournaments(Table):
         )
         return [dto.Teams.parse_obj(dict(item.items())) for item in result]
 
+    @classmethod
+    @connection_check
+    async def get_bracket_teams(cls, tour_id: int) -> list[dto.Team]:
+        result = await pg.fetch(
+            """
+                SELECT * FROM teams
+                JOIN tournament_teams USING (team_id)
+                WHERE tournament_teams.tournament_id = $1
+            """,
+            tour_id
+        )
+        return [dto.Team.parse_obj(dict(item.items())) for item in result]
+
+    @classmethod
+    @connection_check
+    async def get_bracket_settings(cls, tour_id: int) -> tuple[consts.TournamentFormat, int] | None:
+        record = await pg.fetchrow('select format, seed from tournaments where tour_id = $1', tour_id)
+        return (consts.TournamentFormat(record['format']), record['seed']) if record is not None else None
+
+    @classmethod
+    @connection_check
+    async def get_owner_id(cls, tour_id: int) -> int | None:
+        return await pg.fetchval('select owner_id from tournaments where tour_id = $1', tour_id)
+
     @classmethod
     @connection_check
     async def add(cls, tournament: dto.CreateTournament) -> ModelType:
@@ -388,6 +539,81 @@ class Matches(Table):
             user_id
         )
 
+    @classmethod
+    @connection_check
+    async def get_by_tournament(cls, tour_id: int) -> list[asyncpg.Record]:
+        return await pg.fetch(
+            """
+            select match_uuid, first_team_id, second_team_id, winner_id, parent_uuid, started_at, round
+            from matches where tour_id = $1
+            order by round, started_at, match_uuid
+            """,
+            tour_id
+        )
+
+    @classmethod
+    @connection_check
+    async def get_owner_id(cls, match_uuid: str) -> int | None:
+        return await pg.fetchval(
+            """
+            select t.owner_id from matches as m
+            join tournaments as t using(tour_id)
+            where m.match_uuid = $1
+            """,
+            match_uuid
+        )
+
+    @classmethod
+    @connection_check
+    async def advance_winner(cls, parent_uuid: str, winner_id: int):
+        # Победитель занимает свободное место в следующем матче сетки. Выражения в set видят
+        # старую версию строки, поэтому занимается ровно одно место
+        status = await pg.execute(
+            """
+            update matches set
+             first_team_id = coalesce(first_team_id, $2),
+             second_team_id = case when first_team_id is not null then coalesce(second_team_id, $2)
+              else second_team_id end
+            where match_uuid = $1 and (first_team_id is null or second_team_id is null)
+            """,
+            parent_uuid, winner_id
+        )
+        if status == 'UPDATE 0':
+            raise exceptions.BadRequestError(f'В следующем матче {parent_uuid} нет свободного места для победителя')
+
+    @classmethod
+    @connection_check
+    async def record_result(cls, match_uuid: str, result: dto.MatchResult) -> dto.PlayedMatch:
+        if result.first_team_score == result.second_team_score:
+            raise exceptions.BadRequestError('Матч не может закончиться ничьей')
+
+        async with pg.transaction():
+            # Условие на winner_id исключает повторный учет результата в рейтинге
+            record = await pg.fetchrow(
+                """
+                update matches set
+                 first_team_score = $2,
+                 second_team_score = $3,
+                 winner_id = case when $2::integer > $3::integer then first_team_id else second_team_id end,
+                 finished_at = $4
+                where match_uuid = $1 and winner_id is null
+                 and first_team_id is not null and second_team_id is not null
+                returning match_uuid, tour_id, first_team_id, second_team_id,
+                 first_team_score, second_team_score, winner_id, parent_uuid
+                """,
+                match_uuid, result.first_team_score, result.second_team_score, datetime.now(None)
+            )
+            if record is None:
+                raise exceptions.BadRequestError(
+                    f'Невозможно записать результат матча {match_uuid}: матч не найден, уже сыгран или не укомплектован'
+                )
+            played = dto.PlayedMatch.parse_obj(dict(record.items()))
+            if record['parent_uuid'] is not None:
+                await cls.advance_winner(record['parent_uuid'], played.winner_id)
+            loser_id = played.second_team_id if played.winner_id == played.first_team_id else played.first_team_id
+            await Ratings.apply_match(played.winner_id, loser_id)
+        return played
+
 
 class TeamsTable(Table):
     table = 'teams'
@@ -401,19 +627,71 @@ class TeamsTable(Table):
         return team
 
     @classmethod
-    async def assign_to_team(cls, user_id: int,  team_id: int):
-        team = await cls.get_by_id(team_id)
+    @connection_check
+    async def search(cls, query: str, limit: int) -> list[dto.Team]:
+        records = await pg.fetch(
+            """
+            select team_id, title, image_path, created_at, first_participant_id, second_participant_id
+            from teams
+            where title ilike $1 or title % $2
+            order by title ilike $1 desc, similarity(title, $2) desc, title
+            limit $3
+            """,
+            like_pattern(query), query, limit
+        )
+        return [dto.Team.parse_obj(dict(record.items())) for record in records]
 
-        if team.first_participant_id is None:
-            team.first_participant_id = user_id
-            updated_field = 'first_participant_id'
-        elif team.second_participant_id is None:
-            team.second_participant_id = user_id
-            updated_field = 'second_participant_id'
-        else:
-            raise exceptions.BadRequestError(f'Невозможно привязать пользователя к команде ID={team_id}')
+    @classmethod
+    @connection_check
+    async def assign_to_team(cls, user_id: int, team_id: int) -> dto.Team:
+        # Свободное место занимается одним условным UPDATE: при одновременном вступлении
+        # Postgres перепроверяет условие после чужого коммита, и второй пользователь занимает следующее место.
+        # Снимок команды из CTE нужен только для объяснения причины отказа без дополнительного запроса
+        record = await pg.fetchrow(
+            """
+            with team as (
+                select first_participant_id, second_participant_id from teams where team_id = $2
+            ), updated as (
+                update teams set
+                 first_participant_id = coalesce(first_participant_id, $1),
+                 second_participant_id = case
+                  when first_participant_id is null then second_participant_id else $1
+                 end
+                where team_id = $2
+                 and (first_participant_id is null or second_participant_id is null)
+                 and first_participant_id is distinct from $1
+                 and second_participant_id is distinct from $1
+                returning team_id, title, image_path, created_at, first_participant_id, second_participant_id
+            )
+            select updated.*,
+             exists(select 1 from team) as team_exists,
+             coalesce($1 in (team.first_participant_id, team.second_participant_id), false) as is_member
+            from (select 1) as one
+            left join updated on true
+            left join team on true
+            """,
+            user_id, team_id
+        )
+
+        if record['team_id'] is not None:
+            return dto.Team.parse_obj(dict(record.items()))
+        if not record['team_exists']:
+            raise exceptions.NotFoundError(f'Команда с ID: {team_id} не найдена.')
+        if record['is_member']:
+            raise exceptions.BadRequestError(f'Пользователь уже состоит в команде ID={team_id}')
+        raise exceptions.BadRequestError(f'В команде ID={team_id} нет свободных мест')
 
-        return await cls._update(team, pk='team_id', single=True, included={updated_field})
+    @classmethod
+    @connection_check
+    async def set_image(cls, team_id: int, image_path: str) -> dto.Team:
+        record = await pg.fetchrow(
+            """
+            update teams set image_path = $2 where team_id = $1
+            returning team_id, title, image_path, created_at, first_participant_id, second_participant_id
+            """,
+            team_id, image_path
+        )
+        return dto.Team.parse_obj(dict(record.items()))
 
     @classmethod
     async def add(cls, data: dto.CreateTeam) -> dto.Team:
@@ -426,3 +704,152 @@ class TeamsTable(Table):
             await UserTable.get_by_id(data.second_participant_id)
 
         return await cls._add(data)
+
+
+class Ratings(Table):
+    table = 'ratings'
+    model = dto.Rating
+
+    @classmethod
+    @connection_check
+    async def leaderboard(
+        cls,
+        limit: int,
+        after_rating: float | None = None,
+        after_user_id: int | None = None
+    ) -> list[dto.Rating]:
+        # Keyset-пагинация по индексу ratings_leaderboard
+        if after_rating is None or after_user_id is None:
+            after_rating, after_user_id = float('inf'), 0
+        records = await pg.fetch(
+            """
+            select r.user_id, u.nickname, u.image_path, r.rating, r.wins, r.losses
+            from ratings as r
+            join users as u using(user_id)
+            where (r.rating, r.user_id) < ($1, $2)
+            order by r.rating desc, r.user_id desc
+            limit $3
+            """,
+            after_rating, after_user_id, limit
+        )
+        return [dto.Rating.parse_obj(dict(record.items())) for record in records]
+
+    @classmethod
+    @connection_check
+    async def get_team_ratings(cls, team_ids: list[int]) -> dict[int, float]:
+        # Рейтинг команды - средний рейтинг ее игроков
+        records = await pg.fetch(
+            """
+            select t.team_id, avg(coalesce(r.rating, $2)) as rating
+            from teams as t
+            left join users as u on u.user_id in (t.first_participant_id, t.second_participant_id)
+            left join ratings as r on r.user_id = u.user_id
+            where t.team_id = any($1::integer[])
+            group by t.team_id
+            """,
+            team_ids, rating.BASE_RATING
+        )
+        return {record['team_id']: record['rating'] for record in records}
+
+    @classmethod
+    @connection_check
+    async def apply_match(cls, winner_team_id: int, loser_team_id: int):
+        """Обновляет рейтинги игроков по результату матча. Вызывается внутри транзакции записи результата."""
+        records = await pg.fetch(
+            'select team_id, first_participant_id, second_participant_id from teams where team_id in ($1, $2)',
+            winner_team_id, loser_team_id
+        )
+        members = {
+            record['team_id']: {record['first_participant_id'], record['second_participant_id']} - {None}
+            for record in records
+        }
+        winner_ids, loser_ids = members.get(winner_team_id, set()), members.get(loser_team_id, set())
+        # Матчи без игроков в одной из команд и с общим игроком в обеих на рейтинг не влияют,
+        # так же их пропускает rebuild_ratings.compute_ratings
+        if not winner_ids or not loser_ids or winner_ids & loser_ids:
+            return
+
+        now = datetime.now(None)
+        await pg.execute(
+            """
+            insert into ratings (user_id, rating, updated_at)
+            select u.user_id, $3, $4
+            from teams as t
+            join users as u on u.user_id in (t.first_participant_id, t.second_participant_id)
+            where t.team_id in ($1, $2)
+            on conflict (user_id) do nothing
+            """,
+            winner_team_id, loser_team_id, rating.BASE_RATING, now
+        )
+        participants = await pg.fetch(
+            """
+            select t.team_id, r.user_id, r.rating
+            from teams as t
+            join ratings as r on r.user_id in (t.first_participant_id, t.second_participant_id)
+            where t.team_id in ($1, $2)
+            order by r.user_id
+            for update of r
+            """,
+            winner_team_id, loser_team_id
+        )
+        winners = [record for record in participants if record['team_id'] == winner_team_id]
+        losers = [record for record in participants if record['team_id'] == loser_team_id]
+        if not winners or not losers:
+            return
+
+        delta = rating.match_delta(
+            (record['rating'] for record in winners), (record['rating'] for record in losers)
+        )
+        user_ids = [record['user_id'] for record in winners + losers]
+        ratings = [record['rating'] + delta for record in winners] + [record['rating'] - delta for record in losers]
+        wins = [1] * len(winners) + [0] * len(losers)
+        await pg.execute(
+            """
+            update ratings as r set
+             rating = t.rating,
+             wins = r.wins + t.wins,
+             losses = r.losses + 1 - t.wins,
+             updated_at = $4
+            from unnest($1::integer[], $2::double precision[], $3::integer[]) as t(user_id, rating, wins)
+            where r.user_id = t.user_id
+            """,
+            user_ids, ratings, wins, now
+        )
+
+
+class JobsTable(Table):
+    table = 'jobs'
+    model = dto.Job
+
+    @classmethod
+    def parse(cls, record: asyncpg.Record) -> dto.Job:
+        data = dict(record.items())
+        data['result'] = json.loads(data['result']) if data['result'] is not None else None
+        return dto.Job.parse_obj(data)
+
+    @classmethod
+    @connection_check
+    async def enqueue(cls, kind: consts.JobKind, params: dict, owner_id: int) -> dto.Job:
+        record = await pg.fetchrow(
+            """
+            insert into jobs (kind, params, status, created_at, owner_id)
+            values ($1, $2::jsonb, $3, $4, $5)
+            returning job_id, kind, status, progress, result::text, error, owner_id, created_at, started_at, finished_at
+            """,
+            kind.value, json.dumps(params), consts.JobStatus.PENDING.value, datetime.now(None), owner_id
+        )
+        return cls.parse(record)
+
+    @classmethod
+    @connection_check
+    async def get_by_id(cls, job_id: int) -> dto.Job:
+        record = await pg.fetchrow(
+            """
+            select job_id, kind, status, progress, result::text, error, owner_id, created_at, started_at, finished_at
+            from jobs where job_id = $1
+            """,
+            job_id
+        )
+        if record is None:
+            raise exceptions.NotFoundError(f'Задача с ID: {job_id} не найдена.')
+        return cls.parse(record)
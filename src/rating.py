@@ -0,0 +1,22 @@
+from typing import Iterable
+
+BASE_RATING = 1500.0
+ELO_SCALE = 400.0
+K_FACTOR = 32.0
+
+
+def expected_score(rating: float, opponent_rating: float) -> float:
+    return 1.0 / (1.0 + 10 ** ((opponent_rating - rating) / ELO_SCALE))
+
+
+def team_rating(ratings: Iterable[float]) -> float:
+    ratings = list(ratings)
+    return sum(ratings) / len(ratings) if ratings else BASE_RATING
+
+
+def match_delta(winner_ratings: Iterable[float], loser_ratings: Iterable[float]) -> float:
+    """Изменение рейтинга каждого игрока победившей команды (проигравшие теряют столько же).
+
+    Команда оценивается по среднему рейтингу своих игроков.
+    """
+    return K_FACTOR * (1.0 - expected_score(team_rating(winner_ratings), team_rating(loser_ratings)))
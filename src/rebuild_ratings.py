@@ -0,0 +1,124 @@
+"""Пересчет рейтингов игроков по всей истории матчей.
+
+Матчи читаются одним проходом через серверный курсор в порядке записи результатов,
+поэтому итог совпадает с инкрементальным обновлением в Matches.record_result.
+Пересчет и запись идут в одной транзакции под блокировкой таблицы ratings, поэтому
+результаты, записанные во время пересчета, не теряются.
+
+    python src/rebuild_ratings.py            # перезаписать таблицу ratings
+    python src/rebuild_ratings.py --verify   # только сравнить с сохраненными рейтингами
+"""
+import argparse
+import asyncio
+import sys
+from datetime import datetime
+from typing import Awaitable, Callable
+
+import asyncpg
+
+import rating
+from postgres import pg, migrate
+
+MATCHES_QUERY = """
+    select
+     array_remove(array[w.first_participant_id, w.second_participant_id], null) as winners,
+     array_remove(array[l.first_participant_id, l.second_participant_id], null) as losers
+    from matches as m
+    join teams as w on w.team_id = m.winner_id
+    join teams as l on l.team_id = (
+     case when m.winner_id = m.first_team_id then m.second_team_id else m.first_team_id end
+    )
+    where m.winner_id is not null
+    order by coalesce(m.finished_at, m.started_at), m.match_uuid
+"""
+
+RATING_TOLERANCE = 1e-6
+
+
+async def compute_ratings(connection: asyncpg.Connection) -> dict[int, list]:
+    """Вызывается внутри транзакции: курсор на стороне сервера без нее не работает."""
+    # user_id -> [rating, wins, losses]
+    ratings: dict[int, list] = {}
+    async for record in connection.cursor(MATCHES_QUERY, prefetch=1000):
+        winners, losers = record['winners'], record['losers']
+        # Так же, как в Ratings.apply_match: игрок не может выиграть и проиграть в одном матче
+        if not winners or not losers or set(winners) & set(losers):
+            continue
+        for user_id in winners + losers:
+            ratings.setdefault(user_id, [rating.BASE_RATING, 0, 0])
+
+        delta = rating.match_delta(
+            (ratings[user_id][0] for user_id in winners), (ratings[user_id][0] for user_id in losers)
+        )
+        for user_id in winners:
+            ratings[user_id][0] += delta
+            ratings[user_id][1] += 1
+        for user_id in losers:
+            ratings[user_id][0] -= delta
+            ratings[user_id][2] += 1
+    return ratings
+
+
+async def write_ratings(connection: asyncpg.Connection, ratings: dict[int, list]):
+    now = datetime.now(None)
+    await connection.execute('delete from ratings')
+    await connection.copy_records_to_table(
+        'ratings',
+        records=[(user_id, *values, now) for user_id, values in ratings.items()],
+        columns=['user_id', 'rating', 'wins', 'losses', 'updated_at'],
+    )
+
+
+async def rebuild(connection: asyncpg.Connection, progress: Callable[[float], Awaitable[None]] | None = None) -> int:
+    async with connection.transaction():
+        # Блокировка конфликтует с row exclusive в Ratings.apply_match: пересчет дожидается уже начатых
+        # записей результатов, а новые ждут его коммита и применяются к пересчитанным рейтингам.
+        # Снимок матчей берется после блокировки и содержит все закоммиченные результаты
+        await connection.execute('lock table ratings in share row exclusive mode')
+        ratings = await compute_ratings(connection)
+        if progress is not None:
+            await progress(0.5)
+        await write_ratings(connection, ratings)
+    return len(ratings)
+
+
+async def verify_ratings(connection: asyncpg.Connection, ratings: dict[int, list]) -> list[str]:
+    stored = {
+        record['user_id']: [record['rating'], record['wins'], record['losses']]
+        for record in await connection.fetch('select user_id, rating, wins, losses from ratings')
+    }
+    errors = []
+    for user_id in sorted(stored.keys() | ratings.keys()):
+        expected, actual = ratings.get(user_id), stored.get(user_id)
+        if (
+            expected is None or actual is None
+            or abs(expected[0] - actual[0]) > RATING_TOLERANCE
+            or expected[1:] != actual[1:]
+        ):
+            errors.append(f'user_id={user_id}: ожидалось {expected}, сохранено {actual}')
+    return errors
+
+
+async def main(verify: bool) -> int:
+    await migrate()
+    async with pg as connection:
+        if not verify:
+            players = await rebuild(connection)
+            print(f'Пересчитаны рейтинги {players} игроков')
+            return 0
+
+        # Пересчет и сравнение видят один и тот же снимок базы
+        async with connection.transaction(isolation='repeatable_read', readonly=True):
+            ratings = await compute_ratings(connection)
+            errors = await verify_ratings(connection, ratings)
+    for error in errors:
+        print(error)
+    print(f'Проверено игроков: {len(ratings)}, расхождений: {len(errors)}')
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Пересчет рейтингов игроков по истории матчей')
+    parser.add_argument('--verify', action='store_true', help='сравнить с сохраненными рейтингами без записи')
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.verify)))
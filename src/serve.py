@@ -0,0 +1,48 @@
+"""Запуск сервиса в продакшене: несколько процессов uvicorn на одном сокете.
+
+    python src/serve.py
+
+Миграции выполняются один раз до запуска процессов, бюджет соединений с базой
+(POSTGRES_MAX_CONNECTIONS) делится между процессами. SIGTERM завершает процессы
+после обработки текущих запросов, но не дольше GRACEFUL_SHUTDOWN_TIMEOUT секунд.
+"""
+import asyncio
+import os
+
+import uvicorn
+
+import settings
+from postgres import migrate
+
+
+def pool_size(workers: int) -> int:
+    # Каждый обработчик фоновых задач держит соединение для очереди и соединение для самой задачи,
+    # выгрузки используют свои соединения вне пула
+    own_connections = 2 * settings.JOB_WORKERS + settings.EXPORT_MAX_CONNECTIONS
+    return max(1, settings.POSTGRES_MAX_CONNECTIONS // workers - own_connections)
+
+
+def main():
+    workers = settings.WEB_WORKERS or os.cpu_count() or 1
+    asyncio.run(migrate())
+
+    # Настройки передаются процессам через окружение, которое они наследуют
+    max_size = pool_size(workers)
+    os.environ.update(
+        RUN_MIGRATIONS='False',
+        POSTGRES_POOL_MAX_SIZE=str(max_size),
+        POSTGRES_POOL_MIN_SIZE=str(min(settings.POSTGRES_POOL_MIN_SIZE, max_size)),
+    )
+    uvicorn.run(
+        'main:app',
+        host=settings.SERVER_HOST,
+        port=settings.SERVER_PORT,
+        workers=workers,
+        loop='uvloop',
+        proxy_headers=True,
+        timeout_graceful_shutdown=settings.GRACEFUL_SHUTDOWN_TIMEOUT,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+"""Отдельный процесс для выполнения фоновых задач.
+
+    python src/worker.py --concurrency 4
+"""
+import argparse
+import asyncio
+import logging
+import signal
+
+import jobs
+from postgres import migrate
+
+
+async def main(concurrency: int):
+    await migrate()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    # текущие задачи дорабатываются, новые не забираются
+    await asyncio.gather(*(jobs.worker(stop) for _ in range(concurrency)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Обработчик фоновых задач')
+    parser.add_argument('--concurrency', type=int, default=1, help='количество параллельно выполняемых задач')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(args.concurrency))
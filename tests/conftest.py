@@ -0,0 +1,41 @@
+import asyncio
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+os.environ.setdefault('authjwt_secret_key', 'test')
+os.environ.setdefault('DEBUG', 'True')
+
+import asyncpg  # noqa: E402
+
+import dto  # noqa: E402
+import settings  # noqa: E402
+from postgres import migrate  # noqa: E402
+
+
+@pytest.fixture
+def make_teams():
+    def make(count: int, first_id: int = 1) -> list[dto.Team]:
+        return [
+            dto.Team(team_id=first_id + i, title=f'team {first_id + i}', first_participant_id=1, created_at=datetime.now())
+            for i in range(count)
+        ]
+    return make
+
+
+@pytest.fixture(scope='session')
+def database():
+    """Тесты с этой фикстурой работают с базой из POSTGRES_DSN и пропускаются, если она недоступна."""
+    async def check():
+        connection = await asyncpg.connect(settings.POSTGRES_DSN, timeout=3)
+        await connection.close()
+
+    try:
+        asyncio.run(check())
+    except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as exc:
+        pytest.skip(f'Postgres недоступен: {exc}')
+    asyncio.run(migrate())
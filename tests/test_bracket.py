@@ -0,0 +1,87 @@
+import pydantic
+import pytest
+
+import dto
+import formats
+from bracket import bracket_template, seeded_order
+
+
+@pytest.mark.parametrize('teams_count', range(2, 70))
+def test_template_rounds_count_from_the_final(teams_count):
+    template = bracket_template(teams_count)
+    rounds_count = (teams_count - 1).bit_length()
+
+    assert len(template) == teams_count - 1
+    for match in template:
+        if match.parent is None:
+            assert match.round == rounds_count
+        else:
+            assert template[match.parent].round == match.round + 1
+    # Команды, пропускающие первый раунд, попадают только в матчи второго
+    assert all(match.round == 2 for match in template if match.round > 1 and match.first is not None)
+
+
+def test_seeded_bracket_is_reproducible(make_teams):
+    teams = make_teams(11)
+
+    first = formats.SingleElimination(1, teams, seed=42).get_matches()
+    second = formats.SingleElimination(1, list(reversed(teams)), seed=42).get_matches()
+
+    assert [match.match_uuid for match in first] == [match.match_uuid for match in second]
+    assert [
+        [team.team_id if team else None for team in match.participants] for match in first
+    ] == [
+        [team.team_id if team else None for team in match.participants] for match in second
+    ]
+    assert [team.team_id for team in seeded_order(teams, 42)] != [team.team_id for team in seeded_order(teams, 43)]
+
+
+@pytest.mark.parametrize('format_class', [formats.RoundRobin, formats.Swiss])
+def test_generated_match_uuids_are_reproducible(make_teams, format_class):
+    teams = make_teams(7)
+
+    first = format_class(1, teams, seed=42).get_matches()
+    second = format_class(1, list(reversed(teams)), seed=42).get_matches()
+    other_tournament = format_class(2, teams, seed=42).get_matches()
+
+    assert [match.match_uuid for match in first] == [match.match_uuid for match in second]
+    assert len({match.match_uuid for match in first}) == len(first)
+    assert not {match.match_uuid for match in first} & {match.match_uuid for match in other_tournament}
+
+
+@pytest.mark.parametrize('format_class', [formats.SingleElimination, formats.RoundRobin, formats.Swiss])
+@pytest.mark.parametrize('teams_count', [2, 7, 8])
+def test_get_round_matches_full_schedule(make_teams, format_class, teams_count):
+    engine = format_class(1, make_teams(teams_count), seed=7)
+    matches = engine.get_matches()
+
+    for round_number in range(1, max(match.round for match in matches) + 2):
+        assert [match.match_uuid for match in engine.get_round(round_number)] == [
+            match.match_uuid for match in matches if match.round == round_number
+        ]
+
+
+def test_round_robin_round_is_generated_lazily(make_teams, monkeypatch):
+    engine = formats.RoundRobin(1, make_teams(100))
+    generated = []
+    rounds = engine.rounds
+
+    def counting_rounds():
+        for round_matches in rounds():
+            generated.append(round_matches[0].round)
+            yield round_matches
+
+    monkeypatch.setattr(engine, 'rounds', counting_rounds)
+
+    assert {match.round for match in engine.get_round(3)} == {3}
+    assert generated == [1, 2, 3]
+
+
+@pytest.mark.parametrize('seed', [-1, 2 ** 31, 2 ** 63])
+def test_seed_out_of_range_is_rejected(seed):
+    with pytest.raises(pydantic.ValidationError):
+        dto.CreateTournament(title='t', description='', seed=seed)
+
+
+def test_generated_seed_is_in_range():
+    assert 0 <= dto.CreateTournament(title='t', description='').seed < 2 ** 31
@@ -0,0 +1,117 @@
+import asyncio
+import csv
+import io
+import json
+
+import pytest
+
+import consts
+import exceptions
+import export
+import settings
+from postgres import pg
+from serve import pool_size
+
+
+async def read(stream) -> bytes:
+    return b''.join([chunk async for chunk in stream])
+
+
+def test_pool_size_leaves_room_for_exports(monkeypatch):
+    monkeypatch.setattr(settings, 'POSTGRES_MAX_CONNECTIONS', 80)
+    monkeypatch.setattr(settings, 'JOB_WORKERS', 1)
+    monkeypatch.setattr(settings, 'EXPORT_MAX_CONNECTIONS', 2)
+    assert pool_size(8) == 80 // 8 - 2 - 2
+
+
+def test_export_does_not_use_request_pool(database):
+    async def run():
+        await pg.connect(min_size=1, max_size=1)
+        try:
+            # Единственное соединение пула занято запросом, выгрузка все равно должна пройти
+            async with pg:
+                return await asyncio.wait_for(read(export.tournament_matches(-1, consts.ExportFormat.CSV)), 10)
+        finally:
+            await pg.disconnect()
+
+    assert asyncio.run(run()).startswith(b'match_uuid,tour_id,')
+
+
+NASTY_TITLES = [
+    'quote " and \'single\'',
+    'line\nbreak\r\nand\ttab',
+    'back\\slash \\N \\\\',
+    'control \x01\x02\x1b\x7f chars',
+    'comma, semicolon; "quoted, field"',
+    'unicode ё \u2028 🏓',
+]
+
+
+async def create_nasty_tournament() -> int:
+    async with pg as connection:
+        owner_id = await connection.fetchval('select min(user_id) from users') or await connection.fetchval(
+            "insert into users (nickname, created_at, password, login) values ('exporter', now(), '', 'exporter') "
+            'returning user_id'
+        )
+        tour_id = await connection.fetchval(
+            "insert into tournaments (title, description, status, owner_id) values ($1, '', $2, $3) returning tour_id",
+            NASTY_TITLES[0], consts.TournamentStatus.ACTIVE.value, owner_id
+        )
+        team_ids = [
+            await connection.fetchval('insert into teams (title, created_at) values ($1, now()) returning team_id', title)
+            for title in NASTY_TITLES
+        ]
+        for i in range(0, len(team_ids), 2):
+            await connection.execute(
+                """
+                insert into matches (match_uuid, tour_id, first_team_id, second_team_id, started_at)
+                values (gen_random_uuid()::text, $1, $2, $3, now() + make_interval(secs => $4))
+                """,
+                tour_id, team_ids[i], team_ids[i + 1], i
+            )
+    return tour_id
+
+
+def test_ndjson_export_is_valid_json_per_line(database):
+    async def run():
+        tour_id = await create_nasty_tournament()
+        return await read(export.tournament_matches(tour_id, consts.ExportFormat.NDJSON))
+
+    # Строки NDJSON разделяются только \n: U+2028 внутри JSON-строки допустим и разделителем не является
+    lines = asyncio.run(run()).decode().rstrip('\n').split('\n')
+    rows = [json.loads(line) for line in lines]
+
+    assert len(rows) == len(NASTY_TITLES) // 2
+    assert [title for row in rows for title in (row['first_team'], row['second_team'])] == NASTY_TITLES
+    assert all(row['tournament_title'] == NASTY_TITLES[0] for row in rows)
+
+
+def test_csv_export_round_trips(database):
+    async def run():
+        tour_id = await create_nasty_tournament()
+        return await read(export.tournament_matches(tour_id, consts.ExportFormat.CSV))
+
+    header, *rows = csv.reader(io.StringIO(asyncio.run(run()).decode(), newline=''))
+
+    assert header[:3] == ['match_uuid', 'tour_id', 'tournament_title']
+    first_team, second_team = header.index('first_team'), header.index('second_team')
+    assert [title for row in rows for title in (row[first_team], row[second_team])] == NASTY_TITLES
+    assert all(len(row) == len(header) for row in rows)
+
+
+def test_tournament_export_endpoint(database):
+    import main
+
+    async def run():
+        tour_id = await create_nasty_tournament()
+        response = await main.export_tournament(tour_id, export_format=consts.ExportFormat.NDJSON)
+        body = await read(response.body_iterator)
+        with pytest.raises(exceptions.NotFoundError):
+            await main.export_tournament(-tour_id, export_format=consts.ExportFormat.CSV)
+        return tour_id, response, body
+
+    tour_id, response, body = asyncio.run(run())
+
+    assert response.media_type == 'application/x-ndjson'
+    assert response.headers['content-disposition'] == f'attachment; filename="tournament-{tour_id}.ndjson"'
+    assert len(body.rstrip(b'\n').split(b'\n')) == len(NASTY_TITLES) // 2
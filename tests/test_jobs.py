@@ -0,0 +1,98 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import consts
+import jobs
+import settings
+from postgres import pg
+
+
+async def insert_running_job(heartbeat_at: datetime, attempts: int) -> int:
+    async with pg as connection:
+        return await connection.fetchval(
+            """
+            insert into jobs (kind, params, status, created_at, started_at, heartbeat_at, attempts)
+            values ($1, '{}', $2, $3, $3, $3, $4) returning job_id
+            """,
+            consts.JobKind.RATING_BACKFILL.value, consts.JobStatus.RUNNING.value, heartbeat_at, attempts
+        )
+
+
+async def delete_jobs(*job_ids: int):
+    async with pg as connection:
+        await connection.execute('delete from jobs where job_id = any($1::integer[])', job_ids)
+
+
+async def get_job(job_id: int):
+    async with pg as connection:
+        return await connection.fetchrow('select status, heartbeat_at, error from jobs where job_id = $1', job_id)
+
+
+def test_heartbeat_runs_without_progress_calls(database, monkeypatch):
+    monkeypatch.setattr(settings, 'JOB_HEARTBEAT_INTERVAL', 0.05)
+    heartbeats = []
+
+    async def slow_handler(connection, params, progress):
+        for _ in range(2):
+            heartbeats.append(await connection.fetchval('select heartbeat_at from jobs where job_id = $1', job_id))
+            await asyncio.sleep(0.3)
+        return {}
+
+    monkeypatch.setitem(jobs.handlers, consts.JobKind.RATING_BACKFILL, slow_handler)
+
+    async def run():
+        async with pg as connection:
+            await jobs.run_job(
+                connection, {'job_id': job_id, 'kind': consts.JobKind.RATING_BACKFILL.value, 'params': '{}'}
+            )
+
+    job_id = asyncio.run(insert_running_job(datetime.now(None), 1))
+    asyncio.run(run())
+
+    assert heartbeats[1] > heartbeats[0]
+    assert asyncio.run(get_job(job_id))['status'] == consts.JobStatus.DONE.value
+    asyncio.run(delete_jobs(job_id))
+
+
+def test_abandoned_job_fails_after_max_attempts(database):
+    stale = datetime.now(None) - timedelta(seconds=settings.JOB_STALE_TIMEOUT + 60)
+    exhausted_id = asyncio.run(insert_running_job(stale, settings.JOB_MAX_ATTEMPTS))
+    retried_id = asyncio.run(insert_running_job(stale, 1))
+
+    async def run():
+        async with pg as connection:
+            await jobs.fail_abandoned(connection)
+
+    asyncio.run(run())
+
+    exhausted = asyncio.run(get_job(exhausted_id))
+    assert exhausted['status'] == consts.JobStatus.FAILED.value
+    assert exhausted['error']
+    assert asyncio.run(get_job(retried_id))['status'] == consts.JobStatus.RUNNING.value
+    asyncio.run(delete_jobs(exhausted_id, retried_id))
+
+
+def test_failed_job_keeps_only_short_error(database, monkeypatch):
+    async def failing_handler(connection, params, progress):
+        raise RuntimeError('connection string postgres://secret@db')
+
+    async def rejecting_handler(connection, params, progress):
+        raise jobs.JobError('Невозможно создать сетку из одной команды')
+
+    async def run(handler):
+        monkeypatch.setitem(jobs.handlers, consts.JobKind.RATING_BACKFILL, handler)
+        job_id = await insert_running_job(datetime.now(None), 1)
+        async with pg as connection:
+            await jobs.run_job(
+                connection, {'job_id': job_id, 'kind': consts.JobKind.RATING_BACKFILL.value, 'params': '{}'}
+            )
+        job = await get_job(job_id)
+        await delete_jobs(job_id)
+        return job
+
+    failed = asyncio.run(run(failing_handler))
+    assert failed['status'] == consts.JobStatus.FAILED.value
+    assert failed['error'] == jobs.JOB_FAILED_MESSAGE
+
+    rejected = asyncio.run(run(rejecting_handler))
+    assert rejected['error'] == 'Невозможно создать сетку из одной команды'
@@ -0,0 +1,146 @@
+import asyncio
+import uuid
+
+import pytest
+
+import consts
+import dto
+import exceptions
+import jobs
+import main
+from postgres import pg, Matches
+
+
+async def create_tournament(
+    teams_count: int,
+    tournament_format: consts.TournamentFormat = consts.TournamentFormat.SINGLE_ELIMINATION,
+    materialize: bool = True
+) -> int:
+    suffix = uuid.uuid4().hex[:8]
+    async with pg as connection:
+        owner_id = await connection.fetchval(
+            "insert into users (nickname, created_at, password, login) values ($1, now(), '', $2) returning user_id",
+            f'owner-{suffix}', f'owner-{suffix}'
+        )
+        tour_id = await connection.fetchval(
+            """
+            insert into tournaments (title, description, status, owner_id, format)
+            values ($1, '', $2, $3, $4) returning tour_id
+            """,
+            f'tournament-{suffix}', consts.TournamentStatus.OPENED.value, owner_id, tournament_format.value
+        )
+        for number in range(1, teams_count + 1):
+            team_id = await connection.fetchval(
+                'insert into teams (title, created_at) values ($1, now()) returning team_id', f'team-{suffix}-{number}'
+            )
+            await connection.execute('insert into tournament_teams values ($1, $2, $3)', team_id, tour_id, number)
+    if materialize:
+        await materialize_bracket(tour_id)
+    return tour_id
+
+
+async def materialize_bracket(tour_id: int):
+    async def progress(value: float):
+        pass
+
+    async with pg as connection:
+        await jobs.materialize_bracket(connection, {'tour_id': tour_id}, progress)
+
+
+async def play_bracket(tour_id: int) -> list[str]:
+    played = []
+    async with pg as connection:
+        while True:
+            ready = await connection.fetch(
+                """
+                select match_uuid from matches
+                where tour_id = $1 and winner_id is null
+                 and first_team_id is not null and second_team_id is not null
+                """,
+                tour_id
+            )
+            if not ready:
+                return played
+            for record in ready:
+                await Matches.record_result(record['match_uuid'], dto.MatchResult(first_team_score=10, second_team_score=5))
+                played.append(record['match_uuid'])
+
+
+@pytest.mark.parametrize('teams_count', [2, 4, 5, 7])
+def test_bracket_is_played_to_the_final(database, teams_count):
+    async def run():
+        tour_id = await create_tournament(teams_count)
+        played = await play_bracket(tour_id)
+        async with pg as connection:
+            final = await connection.fetchrow(
+                'select winner_id from matches where tour_id = $1 and parent_uuid is null', tour_id
+            )
+            unplayed = await connection.fetchval(
+                'select count(*) from matches where tour_id = $1 and winner_id is null', tour_id
+            )
+        return played, final, unplayed
+
+    played, final, unplayed = asyncio.run(run())
+    assert len(played) == teams_count - 1
+    assert final['winner_id'] is not None
+    assert unplayed == 0
+
+
+def test_stored_bracket_has_rounds(database):
+    async def run():
+        tour_id = await create_tournament(5)
+        async with pg:
+            return await Matches.get_by_tournament(tour_id)
+
+    records = asyncio.run(run())
+    assert [record['round'] for record in records] == [1, 2, 2, 3]
+
+
+def test_result_is_recorded_once(database):
+    async def run():
+        tour_id = await create_tournament(4)
+        async with pg as connection:
+            match_uuid = await connection.fetchval(
+                'select match_uuid from matches where tour_id = $1 and first_team_id is not null limit 1', tour_id
+            )
+            result = dto.MatchResult(first_team_score=3, second_team_score=10)
+            await Matches.record_result(match_uuid, result)
+            with pytest.raises(exceptions.BadRequestError):
+                await Matches.record_result(match_uuid, result)
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize('tournament_format', [consts.TournamentFormat.ROUND_ROBIN, consts.TournamentFormat.SWISS])
+@pytest.mark.parametrize('teams_count', [4, 5])
+def test_generated_matches_keep_uuids_after_materialization(database, tournament_format, teams_count):
+    async def run():
+        tour_id = await create_tournament(teams_count, tournament_format, materialize=False)
+        preview = [str(match.match_uuid) for match in await main.tournament_bracket(tour_id, None)]
+        again = [str(match.match_uuid) for match in await main.tournament_bracket(tour_id, None)]
+        await materialize_bracket(tour_id)
+        async with pg as connection:
+            stored = await connection.fetch('select match_uuid from matches where tour_id = $1', tour_id)
+        return preview, again, [str(record['match_uuid']) for record in stored]
+
+    preview, again, stored = asyncio.run(run())
+    assert preview == again
+    assert len(set(preview)) == len(preview)
+    assert sorted(stored) == sorted(preview)
+
+
+def test_bracket_by_round(database):
+    async def run():
+        tour_id = await create_tournament(6, consts.TournamentFormat.ROUND_ROBIN, materialize=False)
+        full = await main.tournament_bracket(tour_id, None)
+        by_round = [await main.tournament_bracket(tour_id, round_number) for round_number in range(1, 7)]
+        await materialize_bracket(tour_id)
+        stored = await main.tournament_bracket(tour_id, 2)
+        return full, by_round, stored
+
+    full, by_round, stored = asyncio.run(run())
+    assert [[str(match.match_uuid) for match in matches] for matches in by_round] == [
+        [str(match.match_uuid) for match in full if match.round == round_number] for round_number in range(1, 7)
+    ]
+    assert len(by_round[0]) == 3 and by_round[-1] == []
+    assert sorted(str(match.match_uuid) for match in stored) == sorted(str(match.match_uuid) for match in by_round[1])
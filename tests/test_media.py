@@ -0,0 +1,126 @@
+import asyncio
+import io
+
+import pytest
+from fastapi import UploadFile
+from PIL import Image
+
+import exceptions
+import media
+import settings
+
+DIGEST = 'ab' + '0' * 62
+
+
+def make_upload(content: bytes, filename: str = 'image.png') -> UploadFile:
+    return UploadFile(file=io.BytesIO(content), filename=filename)
+
+
+def make_png(color=(200, 30, 30), size=(300, 200)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def media_dirs(tmp_path, monkeypatch):
+    media_root = tmp_path / 'media'
+    upload_dir = tmp_path / 'uploads'
+    monkeypatch.setattr(settings, 'MEDIA_ROOT', str(media_root))
+    monkeypatch.setattr(settings, 'UPLOAD_TMP_DIR', str(upload_dir))
+    monkeypatch.setattr(settings, 'THUMBNAIL_SIZES', [64, 256])
+    monkeypatch.setattr(settings, 'THUMBNAIL_WORKERS', 1)
+    yield media_root, upload_dir
+    media.shutdown()
+
+
+def list_files(root) -> list[str]:
+    return sorted(str(path.relative_to(root)) for path in root.rglob('*') if path.is_file())
+
+
+def test_thumbnail_url(monkeypatch):
+    monkeypatch.setattr(settings, 'THUMBNAIL_SIZES', [64, 256])
+    uploaded = f'/media/ab/{DIGEST}_256.jpg'
+
+    assert media.thumbnail_url(uploaded) == f'/media/ab/{DIGEST}_64.jpg'
+    assert media.thumbnail_url(uploaded, 256) == uploaded
+    assert media.thumbnail_url(None) is None
+    # Пути, указанные вручную, не меняются
+    assert media.thumbnail_url('https://example.com/avatar.png') == 'https://example.com/avatar.png'
+    assert media.thumbnail_url('/media/ab/custom_256.jpg') == '/media/ab/custom_256.jpg'
+
+
+def test_save_image(media_dirs):
+    media_root, upload_dir = media_dirs
+
+    url = asyncio.run(media.save_image(make_upload(make_png())))
+
+    assert url.startswith(settings.MEDIA_URL) and url.endswith('_256.jpg')
+    relative = url[len(settings.MEDIA_URL):]
+    for size in settings.THUMBNAIL_SIZES:
+        with Image.open(media_root / relative.replace('_256.jpg', f'_{size}.jpg')) as image:
+            assert image.format == 'JPEG'
+            assert image.size == (size, size)
+    # Во время обработки загрузка не попадает в раздаваемый каталог и потом удаляется
+    assert not (media_root / 'tmp').exists()
+    assert list_files(upload_dir) == []
+
+
+def test_same_image_is_stored_once(media_dirs):
+    media_root, _ = media_dirs
+    content = make_png()
+
+    async def run():
+        return [
+            await media.save_image(make_upload(content, 'first.png')),
+            await media.save_image(make_upload(content, 'second.png')),
+            await media.save_image(make_upload(make_png(color=(30, 200, 30)))),
+        ]
+
+    first, second, other = asyncio.run(run())
+
+    assert first == second
+    assert other != first
+    assert len(list_files(media_root)) == 2 * len(settings.THUMBNAIL_SIZES)
+
+
+def test_oversize_upload_is_rejected(media_dirs, monkeypatch):
+    media_root, upload_dir = media_dirs
+    content = make_png()
+    monkeypatch.setattr(settings, 'IMAGE_MAX_SIZE', len(content) - 1)
+
+    with pytest.raises(exceptions.BadRequestError):
+        asyncio.run(media.save_image(make_upload(content)))
+
+    assert list_files(upload_dir) == []
+    assert not media_root.exists() or list_files(media_root) == []
+
+
+@pytest.mark.parametrize('content', [b'', b'not an image', b'\x89PNG\r\n\x1a\n' + b'\x00' * 64])
+def test_non_image_is_rejected(media_dirs, content):
+    media_root, upload_dir = media_dirs
+
+    with pytest.raises(exceptions.BadRequestError):
+        asyncio.run(media.save_image(make_upload(content)))
+
+    assert list_files(upload_dir) == []
+    assert not media_root.exists() or list_files(media_root) == []
+
+
+def test_upload_dir_defaults_to_system_tmp(media_dirs, monkeypatch, tmp_path):
+    media_root, _ = media_dirs
+    monkeypatch.setattr(settings, 'UPLOAD_TMP_DIR', None)
+    monkeypatch.setattr(media.tempfile, 'tempdir', str(tmp_path / 'system'))
+    directories = []
+    save_upload = media._save_upload
+
+    async def record(upload, directory):
+        directories.append(directory)
+        return await save_upload(upload, directory)
+
+    monkeypatch.setattr(media, '_save_upload', record)
+
+    asyncio.run(media.save_image(make_upload(make_png())))
+
+    assert directories == [tmp_path / 'system']
+    assert not (media_root / 'tmp').exists()
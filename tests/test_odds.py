@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+import formats
+from odds import BracketSimulator
+
+
+@pytest.mark.parametrize('teams_count', [2, 3, 5, 8, 11, 17, 23, 33, 47, 65, 69])
+def test_round_columns_sum_to_round_slots(make_teams, teams_count):
+    teams = make_teams(teams_count)
+    matches = formats.SingleElimination(1, teams, seed=teams_count).get_matches()
+    simulator = BracketSimulator(matches, {team.team_id: 1000.0 + team.team_id for team in teams})
+
+    probabilities = simulator.simulate(2000, seed=0)
+
+    rounds_count = (teams_count - 1).bit_length()
+    assert simulator.rounds_count == rounds_count
+    # До первого раунда доходят все команды, до раунда k > 1 - по две команды на каждый его матч
+    expected = [teams_count] + [2 ** (rounds_count - k) for k in range(1, rounds_count + 1)]
+    assert np.allclose(probabilities.sum(axis=0), expected)
+
+
+def test_recorded_results_are_kept(make_teams):
+    teams = make_teams(4)
+    matches = formats.SingleElimination(1, teams).get_matches()
+    first_round = [match for match in matches if all(match.participants)]
+    by_uuid = {match.match_uuid: match for match in matches}
+    for match in first_round:
+        match.winner_id = match.participants[0].team_id
+        # Так же, как Matches.record_result, победитель записывается в свободное место следующего матча
+        parent = by_uuid[match.parent_uuid]
+        parent.participants[parent.participants.index(None)] = match.participants[0]
+    simulator = BracketSimulator(matches, {team.team_id: 1000.0 for team in teams})
+
+    probabilities = simulator.simulate(1000, seed=0)
+
+    reached_final = {match.participants[0].team_id for match in first_round}
+    for i, team_id in enumerate(simulator.team_ids):
+        assert probabilities[i, 1] == (1.0 if team_id in reached_final else 0.0)
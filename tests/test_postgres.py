@@ -0,0 +1,25 @@
+import asyncio
+
+import pytest
+
+import settings
+from postgres import PostgresManager
+
+
+@pytest.mark.parametrize('pooled', [False, True])
+def test_nested_block_restores_outer_connection(database, pooled):
+    async def run():
+        manager = PostgresManager(settings.POSTGRES_DSN)
+        if pooled:
+            await manager.connect(min_size=1, max_size=2)
+        try:
+            async with manager as outer:
+                async with manager as inner:
+                    assert inner is not outer
+                    assert await manager.fetchval('select pg_backend_pid()') == inner.get_server_pid()
+                assert await manager.fetchval('select pg_backend_pid()') == outer.get_server_pid()
+            assert not manager.connected
+        finally:
+            await manager.disconnect()
+
+    asyncio.run(run())
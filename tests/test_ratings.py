@@ -0,0 +1,102 @@
+import asyncio
+import uuid
+
+import consts
+import dto
+import rebuild_ratings
+from postgres import pg, Matches, PostgresManager
+
+
+async def create_match(*teams: tuple[int, int]) -> str:
+    """Турнир с одним матчем между командами, составленными из игроков с указанными номерами."""
+    suffix = uuid.uuid4().hex[:8]
+    async with pg as connection:
+        user_ids = {}
+        for number in sorted({number for team in teams for number in team}):
+            user_ids[number] = await connection.fetchval(
+                "insert into users (nickname, created_at, password, login) values ($1, now(), '', $2) returning user_id",
+                f'rated-{suffix}-{number}', f'rated-{suffix}-{number}'
+            )
+        team_ids = [
+            await connection.fetchval(
+                """
+                insert into teams (title, created_at, first_participant_id, second_participant_id)
+                values ($1, now(), $2, $3) returning team_id
+                """,
+                f'rated-{suffix}', user_ids[first], user_ids[second]
+            )
+            for first, second in teams
+        ]
+        tour_id = await connection.fetchval(
+            "insert into tournaments (title, description, status, owner_id) values ($1, '', $2, $3) returning tour_id",
+            f'rated-{suffix}', consts.TournamentStatus.ACTIVE.value, user_ids[teams[0][0]]
+        )
+        match_uuid = str(uuid.uuid4())
+        await connection.execute(
+            """
+            insert into matches (match_uuid, tour_id, first_team_id, second_team_id, started_at)
+            values ($1, $2, $3, $4, now())
+            """,
+            match_uuid, tour_id, *team_ids
+        )
+    return match_uuid
+
+
+async def verify() -> list[str]:
+    async with PostgresManager() as connection:
+        async with connection.transaction(isolation='repeatable_read', readonly=True):
+            ratings = await rebuild_ratings.compute_ratings(connection)
+            return await rebuild_ratings.verify_ratings(connection, ratings)
+
+
+def test_result_recorded_during_rebuild_is_kept(database, monkeypatch):
+    async def run():
+        match_uuid = await create_match((1, 2), (3, 4))
+        computed = asyncio.Event()
+        write_ratings = rebuild_ratings.write_ratings
+
+        async def slow_write_ratings(connection, ratings):
+            computed.set()
+            await asyncio.sleep(0.3)
+            await write_ratings(connection, ratings)
+
+        monkeypatch.setattr(rebuild_ratings, 'write_ratings', slow_write_ratings)
+
+        async def backfill():
+            async with PostgresManager() as connection:
+                await rebuild_ratings.rebuild(connection)
+
+        task = asyncio.create_task(backfill())
+        await computed.wait()
+        async with pg:
+            await Matches.record_result(match_uuid, dto.MatchResult(first_team_score=10, second_team_score=5))
+        await task
+        return await verify()
+
+    assert asyncio.run(run()) == []
+
+
+def test_match_with_shared_player_is_skipped(database):
+    async def run():
+        match_uuid = await create_match((1, 2), (1, 3))
+        async with pg as connection:
+            await Matches.record_result(match_uuid, dto.MatchResult(first_team_score=10, second_team_score=5))
+            user_ids = await connection.fetchval(
+                """
+                select array_agg(distinct user_id) from matches
+                join teams on teams.team_id in (matches.first_team_id, matches.second_team_id)
+                cross join unnest(array[teams.first_participant_id, teams.second_participant_id]) as user_id
+                where matches.match_uuid = $1
+                """,
+                match_uuid
+            )
+            stored = await connection.fetchval('select count(*) from ratings where user_id = any($1::integer[])', user_ids)
+            async with connection.transaction(readonly=True):
+                computed = await rebuild_ratings.compute_ratings(connection)
+        return user_ids, stored, computed
+
+    user_ids, stored, computed = asyncio.run(run())
+    assert len(user_ids) == 3
+    # Ни инкрементальное обновление, ни пересчет не учитывают матч с общим игроком
+    assert stored == 0
+    assert not set(user_ids) & computed.keys()
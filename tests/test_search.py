@@ -0,0 +1,141 @@
+import asyncio
+import json
+import uuid
+from urllib.parse import urlencode
+
+import pytest
+
+import main
+import settings
+from cache import TTLCache
+from postgres import pg, like_pattern, TeamsTable, UserTable
+
+
+async def get(path: str, **params) -> tuple[int, object]:
+    """GET-запрос к приложению напрямую через ASGI."""
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await main.app(
+        {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'root_path': '', 'query_string': urlencode(params).encode(),
+            'headers': [], 'client': ('test', 1), 'server': ('test', 80),
+        },
+        receive,
+        send
+    )
+    body = b''.join(message.get('body', b'') for message in messages if message['type'] == 'http.response.body')
+    return messages[0]['status'], json.loads(body)
+
+
+async def create_users(*nicknames: str):
+    async with pg as connection:
+        for nickname in nicknames:
+            await connection.execute(
+                "insert into users (nickname, created_at, password, login) values ($1, now(), '', $2)",
+                nickname, f'login-{uuid.uuid4().hex}'
+            )
+
+
+def test_like_pattern_escapes_wildcards():
+    assert like_pattern('100%') == '100\\%%'
+    assert like_pattern('a_b') == 'a\\_b%'
+    assert like_pattern('c\\d') == 'c\\\\d%'
+
+
+@pytest.mark.parametrize('prefix, matches, misses', [
+    ('100%', ['100%', '100% off'], ['1000', '100']),
+    ('a_b', ['a_b', 'a_bc'], ['axb', 'ab']),
+    ('c\\d', ['c\\d', 'c\\de'], ['cd', 'c\\\\d']),
+])
+def test_like_pattern_matches_only_literal_prefix(database, prefix, matches, misses):
+    async def run():
+        async with pg as connection:
+            return [
+                await connection.fetchval('select $2::text ilike $1', like_pattern(prefix), value)
+                for value in matches + misses
+            ]
+
+    assert asyncio.run(run()) == [True] * len(matches) + [False] * len(misses)
+
+
+def test_prefix_matches_go_before_fuzzy(database):
+    tag = uuid.uuid4().hex[:6]
+
+    async def run():
+        await create_users(f'x{tag}falcon', f'{tag}falconer', f'{tag}falcon')
+        async with pg:
+            users = await UserTable.search(f'{tag}falcon', 10)
+            teams = await TeamsTable.search(f'{tag}falcon', 10)
+        return [user.nickname for user in users], teams
+
+    nicknames, teams = asyncio.run(run())
+
+    assert nicknames[:2] == [f'{tag}falcon', f'{tag}falconer']
+    assert f'x{tag}falcon' in nicknames[2:]
+    assert teams == []
+
+
+def test_search_limit(database):
+    tag = uuid.uuid4().hex[:6]
+
+    async def run():
+        await create_users(*(f'{tag}limit{i}' for i in range(5)))
+        main.users_search_cache.clear()
+        ok = await get('/search/users', q=f'{tag}limit', limit=2)
+        too_many = await get('/search/users', q=f'{tag}limit', limit=settings.SEARCH_MAX_LIMIT + 1)
+        return ok, too_many
+
+    (status, users), (too_many_status, _) = asyncio.run(run())
+
+    assert status == 200
+    assert len(users) == 2
+    assert too_many_status == 422
+
+
+def test_short_queries_are_cached(database):
+    calls = []
+
+    async def search(query: str, limit: int) -> list:
+        calls.append((query, limit))
+        return [query]
+
+    async def run():
+        cache = TTLCache(maxsize=10, ttl=60)
+        short = 'a' * settings.SEARCH_CACHE_PREFIX_LENGTH
+        long = 'a' * (settings.SEARCH_CACHE_PREFIX_LENGTH + 1)
+        for query, limit in [(short, 10), (short.upper() + ' ', 10), (short, 5), (long, 10), (long, 10)]:
+            await main.cached_search(cache, search, query, limit)
+        return short, long
+
+    short, long = asyncio.run(run())
+
+    # Регистр и пробелы по краям не влияют на ключ кэша, другой limit - это другой ключ,
+    # длинные запросы не кэшируются
+    assert calls == [(short, 10), (short, 5), (long, 10), (long, 10)]
+
+
+def test_cache_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('cache.time.monotonic', lambda: now[0])
+    cache = TTLCache(maxsize=2, ttl=30)
+
+    cache.set('a', 1)
+    now[0] += 29
+    assert cache.get('a') == 1
+    now[0] += 2
+    assert cache.get('a') is None
+
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    # Вытесняется давно не использованная запись
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
@@ -0,0 +1,90 @@
+import asyncio
+import collections
+import uuid
+
+import exceptions
+from postgres import pg, TeamsTable
+
+USERS_COUNT = 16
+TEAMS_COUNT = 30
+
+
+async def create_users(count: int) -> list[int]:
+    suffix = uuid.uuid4().hex[:8]
+    async with pg as connection:
+        return [
+            await connection.fetchval(
+                "insert into users (nickname, created_at, password, login) values ($1, now(), '', $2) returning user_id",
+                f'player-{suffix}-{i}', f'player-{suffix}-{i}'
+            )
+            for i in range(count)
+        ]
+
+
+async def create_teams(count: int) -> list[int]:
+    async with pg as connection:
+        return [
+            await connection.fetchval("insert into teams (title, created_at) values ('stress', now()) returning team_id")
+            for _ in range(count)
+        ]
+
+
+async def join(user_id: int, team_id: int) -> str:
+    try:
+        await TeamsTable.assign_to_team(user_id, team_id)
+    except exceptions.ServiceException as exc:
+        return f'{exc.status_code}: {exc.message}'
+    return 'ok'
+
+
+def test_concurrent_join_fills_each_team_once(database):
+    async def run():
+        user_ids = await create_users(USERS_COUNT)
+        team_ids = await create_teams(TEAMS_COUNT)
+        start = asyncio.Event()
+
+        async def player(user_id: int) -> list[str]:
+            # Каждый игрок работает на своем соединении, поэтому вступления действительно конкурируют в базе
+            async with pg:
+                await start.wait()
+                return [await join(user_id, team_id) for team_id in team_ids]
+
+        players = [asyncio.create_task(player(user_id)) for user_id in user_ids]
+        await asyncio.sleep(0.5)
+        start.set()
+        results = [result for results in await asyncio.gather(*players) for result in results]
+
+        async with pg as connection:
+            teams = await connection.fetch(
+                'select first_participant_id, second_participant_id from teams where team_id = any($1::integer[])',
+                team_ids
+            )
+        return results, teams
+
+    results, teams = asyncio.run(run())
+
+    outcomes = collections.Counter('ok' if result == 'ok' else result.split(':')[0] for result in results)
+    assert outcomes == {'ok': 2 * TEAMS_COUNT, '400': (USERS_COUNT - 2) * TEAMS_COUNT}
+    for team in teams:
+        assert team['first_participant_id'] is not None
+        assert team['second_participant_id'] is not None
+        assert team['first_participant_id'] != team['second_participant_id']
+
+
+def test_join_failure_reasons(database):
+    async def run():
+        first, second, third = await create_users(3)
+        (team_id,) = await create_teams(1)
+        async with pg:
+            missing = await join(first, -team_id)
+            await TeamsTable.assign_to_team(first, team_id)
+            member = await join(first, team_id)
+            await TeamsTable.assign_to_team(second, team_id)
+            full = await join(third, team_id)
+        return team_id, missing, member, full
+
+    team_id, missing, member, full = asyncio.run(run())
+
+    assert missing == f'404: Команда с ID: {-team_id} не найдена.'
+    assert member == f'400: Пользователь уже состоит в команде ID={team_id}'
+    assert full == f'400: В команде ID={team_id} нет свободных мест'